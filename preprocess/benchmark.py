@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import queue
+import resource
+import platform
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime, timezone
+import pandas as pd
+import combining
+import renaming_mappin
+import cube
+import synthetic_data
+
+DEFAULT_SIZES = (1_000_000, 10_000_000, 50_000_000)
+
+# How often run_step checks that the step process is still alive
+POLL_INTERVAL_S = 1.0
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _load(workdir, name):
+    return pd.read_csv(os.path.join(workdir, name))
+
+def _timer(start=None, **counts):
+    now = (time.perf_counter(), time.process_time())
+    if start is None:
+        return now
+    return dict(wall_s=round(now[0] - start[0], 4), cpu_s=round(now[1] - start[1], 4), **counts)
+
+# Each step runs in a fresh process so its peak RSS is not inflated by earlier
+# steps. Setup (loading inputs) happens before the timer starts but is included
+# in the reported peak RSS.
+def step_combine_files(workdir):
+    combining.DATA_ROOT = os.path.join(workdir, 'data')
+    start = _timer()
+    df = combining.combine_files('dot2_*.csv')
+    return _timer(start, rows_in=len(df), rows_out=len(df))
+
+def step_stream_combine_files(workdir):
+    combining.DATA_ROOT = os.path.join(workdir, 'data')
+    start = _timer()
+    rows = combining.stream_combine_files('dot2_*.csv', os.path.join(workdir, 'bench_stream.csv'))
+    return _timer(start, rows_in=rows, rows_out=rows)
+
+def step_apply_mappings(workdir):
+    df = _load(workdir, 'dot2_all.csv')
+    start = _timer()
+    mapped = renaming_mappin.apply_mappings(df, 'dot2')
+    return _timer(start, rows_in=len(df), rows_out=len(mapped))
+
+def step_save_enriched_data(workdir):
+    df = _load(workdir, 'dot2_all.csv')
+    mapped = renaming_mappin.apply_mappings(df, 'dot2')
+    start = _timer()
+    renaming_mappin.save_enriched_data(df, mapped, os.path.join(workdir, 'bench_enriched.csv'), 'dot2')
+    return _timer(start, rows_in=len(df), rows_out=len(df))
+
+def step_notebook_aggregations(workdir):
+    """The notebook's Period, mode revenue and port cost-per-weight groupbys."""
+    df = renaming_mappin.apply_mappings(_load(workdir, 'dot2_all.csv'), 'dot2')
+    start = _timer()
+    period = df['Year'].astype(str) + '-' + df['Month'].astype(str)
+    df.groupby(period)['Weight'].sum()
+    df.groupby('Mode_of_Transport', observed=True)['Trade_Value'].sum()
+    cube.add_cost_per_weight(df)
+    df.groupby('Port_District', observed=True)['Cost_per_Weight'].mean()
+    return _timer(start, rows_in=len(df), rows_out=len(df))
+
+def step_cube_build(workdir):
+    df = renaming_mappin.apply_mappings(_load(workdir, 'dot2_all.csv'), 'dot2')
+    start = _timer()
+    built = cube.build_cube(df)
+    return _timer(start, rows_in=len(df), rows_out=sum(len(v) for v in built.values()))
+
+STEPS = {
+    'combine_files': step_combine_files,
+    'stream_combine_files': step_stream_combine_files,
+    'apply_mappings': step_apply_mappings,
+    'save_enriched_data': step_save_enriched_data,
+    'notebook_aggregations': step_notebook_aggregations,
+    'cube_build': step_cube_build,
+}
+
+def _child(step, workdir, results):
+    try:
+        result = STEPS[step](workdir)
+        result['peak_rss_mb'] = round(_peak_rss_mb(), 1)
+        results.put(result)
+    except Exception as e:
+        results.put({'error': f'{type(e).__name__}: {e}'})
+
+def _exit_error(exitcode):
+    if exitcode < 0:
+        return f'Step process killed by signal {-exitcode}'
+    return f'Step process exited with code {exitcode}'
+
+def run_step(step, workdir, timeout=None):
+    """Run one benchmark step in a fresh process and return its measurements.
+
+    A process that dies without reporting (e.g. killed by the OOM killer),
+    exits with a non-zero code or runs longer than ``timeout`` seconds is
+    recorded as an ``error`` result instead of hanging the harness.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(step, workdir, results))
+    proc.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    result = None
+    while result is None:
+        alive = proc.is_alive()
+        try:
+            result = results.get(timeout=POLL_INTERVAL_S)
+        except queue.Empty:
+            if not alive:
+                # Checked before the wait, so a result sent just before exiting is not missed
+                proc.join()
+                result = {'error': _exit_error(proc.exitcode) + ' without a result'}
+            elif deadline is not None and time.monotonic() > deadline:
+                proc.kill()
+                result = {'error': f'Timed out after {timeout}s'}
+    proc.join()
+    if proc.exitcode and 'error' not in result:
+        result['error'] = _exit_error(proc.exitcode)
+    return dict(step=step, **result)
+
+def prepare(workdir, rows, months, seed=0):
+    """Generate the synthetic source tree and the combined dot2 input."""
+    data_dir = os.path.join(workdir, 'data')
+    synthetic_data.generate(data_dir, rows, datasets=('dot2',), months=months, seed=seed)
+    combining.DATA_ROOT = data_dir
+    combining.stream_combine_files('dot2_*.csv', os.path.join(workdir, 'dot2_all.csv'))
+
+def run(sizes=DEFAULT_SIZES, steps=tuple(STEPS), months=60, workdir=None, seed=0, timeout=None):
+    results = []
+    for rows in sizes:
+        with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+            print(f"Preparing {rows:,} synthetic rows...")
+            prepare(tmp, rows, months, seed)
+            for step in steps:
+                result = run_step(step, tmp, timeout)
+                result['rows'] = rows
+                print(json.dumps(result))
+                results.append(result)
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'cpu_count': os.cpu_count(),
+        'months': months,
+        'results': results,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the preprocess pipeline on synthetic data.")
+    parser.add_argument('--rows', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--steps', nargs='+', choices=list(STEPS), default=list(STEPS))
+    parser.add_argument('--months', type=int, default=60)
+    parser.add_argument('--workdir', default=None, help="Where to put the temporary synthetic data")
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="Seconds after which a step is killed and recorded as an error")
+    args = parser.parse_args()
+
+    report = run(args.rows, args.steps, args.months, args.workdir, timeout=args.timeout)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
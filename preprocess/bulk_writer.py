@@ -0,0 +1,245 @@
+import os
+import gzip
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import metrics
+import derive
+import storage
+from renaming_mappin import COLUMN_RENAMES
+
+CODECS = ('none', 'gzip', 'zstd')
+CODEC_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+DEFAULT_BATCH_ROWS = 250_000
+
+# Datasets that may be queued or being written at once; submitting another
+# waits for the oldest to finish
+DEFAULT_MAX_DATASETS = 1
+
+def compressed_path(path, codec):
+    """Output path with the codec's file suffix (``.gz``/``.zst``)."""
+    suffix = CODEC_SUFFIXES[codec]
+    return path if not suffix or path.endswith(suffix) else path + suffix
+
+def _compressor(codec):
+    if codec == 'none':
+        return lambda data: data
+    if codec == 'gzip':
+        # Independently compressed members concatenate into a valid gzip file
+        return lambda data: gzip.compress(data, compresslevel=6)
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("The zstd codec requires zstandard: pip install zstandard") from e
+        # zstd frames concatenate into a valid stream as well
+        return lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS}")
+
+def _format_column(series):
+    """CSV-encode one column, one string per row, or None if it cannot be split.
+
+    Single-column frames quote empty cells as ``""``; those are reset to the
+    unquoted empty cell that a multi-column ``to_csv`` writes.
+    """
+    text = series.to_frame().to_csv(index=False, header=False, lineterminator='\n')
+    lines = text.split('\n')[:-1]
+    if len(lines) != len(series):
+        # A value contains a line break
+        return None
+    return ['' if line == '""' else line for line in lines]
+
+def _join_rows(cells):
+    if not len(cells[0]):
+        return ''
+    return '\n'.join(map(','.join, zip(*cells))) + '\n'
+
+def output_layouts(df_original, df_mapped, dataset_name, stages):
+    """Column plan of each output as ``[(source, column, header), ...]``.
+
+    'cleaned' is every mapped column; 'enriched' is every original column
+    followed by the mapped columns as ``<name>_MAPPED`` and the derived
+    metrics under their own names, exactly as ``renaming_mappin.enrich_data``
+    lays them out.
+    """
+    layouts = {}
+    if 'cleaned' in stages:
+        layouts['cleaned'] = [('mapped', col, col) for col in df_mapped.columns]
+    if 'enriched' in stages:
+        original = [c.strip().upper() for c in df_original.columns]
+        layout = [('original', col, name) for col, name in zip(df_original.columns, original)]
+        for orig_col, new_col in COLUMN_RENAMES.get(dataset_name, {}).items():
+            if orig_col in original and new_col in df_mapped.columns:
+                layout.append(('mapped', new_col, f'{new_col}_MAPPED'))
+        layout += [('mapped', col, col) for col in derive.DERIVED_COLUMNS if col in df_mapped.columns]
+        layouts['enriched'] = layout
+    return layouts
+
+def encode_batch(df_original, df_mapped, layouts, header, compress):
+    """Format one row batch for every output in a single pass over its columns.
+
+    Each distinct column is CSV-encoded once and shared by all outputs that
+    contain it. Returns ``{stage: compressed bytes}``.
+    """
+    cache = {}
+    frames = {'original': df_original, 'mapped': df_mapped}
+    encoded = {}
+    for stage, layout in layouts.items():
+        cells = []
+        for source, col, _ in layout:
+            key = (source, col)
+            if key not in cache:
+                cache[key] = _format_column(frames[source][col])
+            cells.append(cache[key])
+        if any(c is None for c in cells):
+            # Fall back to pandas for batches with embedded line breaks
+            frame = pd.DataFrame({name: frames[source][col] for source, col, name in layout})
+            text = frame.to_csv(index=False, header=False, lineterminator='\n')
+        else:
+            text = _join_rows(cells) if cells else ''
+        if header:
+            names = [name for _, _, name in layout]
+            text = pd.DataFrame(columns=names).to_csv(index=False, lineterminator='\n') + text
+        encoded[stage] = compress(text.encode('utf-8'))
+    return encoded
+
+class _Batch:
+    """One row batch being formatted, shared by the writers of every output.
+
+    Each writer ``take``s its output's bytes, which drops them from the batch;
+    once every output is done with it the batch's slot is released.
+    """
+
+    def __init__(self, future, stages, release):
+        self.future = future
+        self.pending = set(stages)
+        self._release = release
+        self._lock = threading.Lock()
+
+    def take(self, stage):
+        """This output's bytes (re-raises a formatting error)."""
+        try:
+            return self.future.result().pop(stage)
+        finally:
+            self.done(stage)
+
+    def done(self, stage):
+        with self._lock:
+            self.pending.discard(stage)
+            if self.pending or self.future is None:
+                return
+            self.future = None
+        self._release()
+
+class BulkWriter:
+    """Write cleaned/enriched CSV outputs from a thread pool.
+
+    ``submit`` splits a dataset into row batches that are formatted and
+    compressed concurrently, while one writer task per output file appends
+    the finished batches in order. Formatting, compression and disk I/O
+    overlap across outputs and with mapping the next dataset, within two
+    bounds: at most ``max_batches`` batches are held between formatting and
+    being written by every output, and at most ``max_datasets`` datasets are
+    queued or being written. ``submit`` blocks until it fits both, so on a
+    slow disk memory stays bounded instead of filling up with formatted
+    output. Use as a context manager, or call ``close`` to wait for all
+    writes and re-raise any error.
+    """
+
+    def __init__(self, workers=None, codec='none', batch_rows=DEFAULT_BATCH_ROWS, max_batches=None,
+                 max_datasets=DEFAULT_MAX_DATASETS):
+        # ThreadPoolExecutor's own default pool size
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.codec = codec
+        self.batch_rows = batch_rows
+        self._compress = _compressor(codec)
+        self._format_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='format')
+        self._io_pool = ThreadPoolExecutor(thread_name_prefix='write')
+        self._batch_slots = threading.BoundedSemaphore(max_batches or 2 * workers)
+        self._dataset_slots = threading.BoundedSemaphore(max_datasets)
+        self._writes = []
+        self._lock = threading.Lock()
+
+    def submit(self, df_original, df_mapped, output_paths, dataset_name):
+        """Queue a dataset; ``output_paths`` maps 'cleaned'/'enriched' to CSV paths.
+
+        Returns the actual output paths (with the codec suffix).
+        """
+        layouts = output_layouts(df_original, df_mapped, dataset_name, output_paths)
+        paths = {stage: compressed_path(path, self.codec) for stage, path in output_paths.items()}
+        for path in paths.values():
+            # Drop the parquet form and the other codecs' files of this output
+            storage.remove_other_formats(path, 'csv')
+        if not paths:
+            return paths
+
+        self._dataset_slots.acquire()
+        queues = {stage: queue.Queue() for stage in paths}
+        remaining = [len(paths)]
+
+        def finished():
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self._dataset_slots.release()
+
+        for stage, path in paths.items():
+            write = self._io_pool.submit(self._write_output, path, stage, queues[stage], finished, dataset_name)
+            with self._lock:
+                self._writes.append(write)
+
+        try:
+            for i, start in enumerate(range(0, max(len(df_mapped), 1), self.batch_rows)):
+                self._batch_slots.acquire()
+                stop = start + self.batch_rows
+                future = self._format_pool.submit(
+                    encode_batch, df_original.iloc[start:stop], df_mapped.iloc[start:stop],
+                    layouts, i == 0, self._compress,
+                )
+                batch = _Batch(future, paths, self._batch_slots.release)
+                for batches in queues.values():
+                    batches.put(batch)
+        finally:
+            for batches in queues.values():
+                batches.put(None)
+        return paths
+
+    def _write_output(self, path, stage, batches, finished, dataset_name):
+        written = 0
+        drained = False
+        try:
+            with metrics.stage('write', dataset=dataset_name, output=stage) as record:
+                with open(path, 'wb') as f:
+                    while (batch := batches.get()) is not None:
+                        data = batch.take(stage)
+                        f.write(data)
+                        written += len(data)
+                    drained = True
+                record['bytes_written'] = written
+        finally:
+            # After an error the batches still queued are released unwritten
+            while not drained:
+                batch = batches.get()
+                if batch is None:
+                    drained = True
+                else:
+                    batch.done(stage)
+            finished()
+        return path
+
+    def close(self):
+        try:
+            for write in self._writes:
+                write.result()
+        finally:
+            self._format_pool.shutdown()
+            self._io_pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+from collections.abc import Mapping
+from functools import lru_cache
+
+# BTS code -> label tables live in codebooks.json and are read on first use.
+# This module imports neither pandas nor numpy, so lookup-only callers
+# (worker processes, small CLIs) start quickly.
+CODEBOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'codebooks.json')
+CODEBOOK_VERSION = 1
+
+# Mapping relationships: original_column -> codebook name
+COLUMN_MAPPINGS = {
+    'TRDTYPE': 'trade_type_map',
+    'USASTATE': 'us_state_map',
+    'DEPE': 'port_district_map',
+    'DISAGMOT': 'mode_map',
+    'MEXSTATE': 'mex_state_map',
+    'CANPROV': 'canada_prov_map',
+    'COUNTRY': 'country_map',
+    'DF': 'df_map',
+    'CONTCODE': 'container_code_map',
+    'MONTH': 'month_map',
+    'COMMODITY2': 'commodity_map'
+}
+
+# Raw spellings that are treated as missing and mapped to the unknown value
+NULL_REPRESENTATIONS = ('nan', 'None', 'NULL', 'null', '', ' ', 'NaN', 'N/A')
+
+@lru_cache(maxsize=None)
+def load_codebooks(path=CODEBOOK_PATH):
+    """Read the codebook file once, checking its format version."""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != CODEBOOK_VERSION:
+        raise ValueError(f"Unsupported codebook version {data.get('version')!r} in {path}, "
+                         f"expected {CODEBOOK_VERSION}")
+    return data
+
+def codebook_hash(path=CODEBOOK_PATH):
+    """Hash of the codebook tables' content; editing any label changes it."""
+    tables = load_codebooks(path)['tables']
+    return hashlib.blake2b(json.dumps(tables, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+class Codebooks(Mapping):
+    """Read-only ``{name: {code: label}}`` view that loads the file on first access."""
+
+    def __init__(self, path=CODEBOOK_PATH):
+        self.path = path
+
+    def _tables(self):
+        return load_codebooks(self.path)['tables']
+
+    def __getitem__(self, name):
+        return self._tables()[name]
+
+    def __iter__(self):
+        return iter(self._tables())
+
+    def __len__(self):
+        return len(self._tables())
+
+MAPPINGS = Codebooks()
+
+def compile_mapping(mapping_dict, unknown_value="Unknown"):
+    """Compile a mapping dict and the null spellings into one lookup table.
+
+    Returns the lookup (raw string -> label) and the fixed, ordered category
+    set of the mapped column (all labels followed by the unknown value).
+    """
+    lookup = {str(code): (unknown_value if label in NULL_REPRESENTATIONS else label)
+              for code, label in mapping_dict.items()}
+    for null_rep in NULL_REPRESENTATIONS:
+        lookup.setdefault(null_rep, unknown_value)
+    categories = list(dict.fromkeys(list(lookup.values()) + [unknown_value]))
+    return lookup, categories
+
+@lru_cache(maxsize=None)
+def compiled_mapping(mapping_name, unknown_value="Unknown"):
+    """Compiled lookup table for a named entry of ``MAPPINGS``, built once."""
+    return compile_mapping(MAPPINGS[mapping_name], unknown_value)
+
+def lookup(mapping_name, code, unknown_value="Unknown"):
+    """Label of a single raw code; codes missing from the codebook are returned as is."""
+    code = str(code)
+    return compiled_mapping(mapping_name, unknown_value)[0].get(code, code)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the BTS codebooks.")
+    parser.add_argument('table', nargs='?', choices=sorted(MAPPINGS), help="Codebook to look codes up in")
+    parser.add_argument('codes', nargs='*')
+    args = parser.parse_args()
+
+    if args.table is None:
+        data = load_codebooks()
+        print(f"{CODEBOOK_PATH} (version {data['version']}, from {data['source']})")
+        for name, table in data['tables'].items():
+            print(f"  {name}: {len(table)} codes")
+    else:
+        for code in args.codes or sys.stdin.read().split():
+            print(f"{code}\t{lookup(args.table, code)}")
@@ -1,52 +1,272 @@
 import os
 import glob
+import hashlib
+import shutil
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import storage
+import metrics
+import sketches
 
 DATA_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data'))
 OUTPUT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../worked_data'))
 
-# Ensure output directory exists
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
 def standardize_columns(df):
     df.columns = [str(col).strip().upper() for col in df.columns]
     return df
 
-def find_csv_files(pattern):
+def find_csv_files(pattern, data_root=None):
     # Recursively find all files matching the pattern in DATA_ROOT
-    return glob.glob(os.path.join(DATA_ROOT, '**', pattern), recursive=True)
+    data_root = data_root or DATA_ROOT
+    with metrics.stage('glob', pattern=pattern) as record:
+        files = sorted(glob.glob(os.path.join(data_root, '**', pattern), recursive=True))
+        record['rows_out'] = len(files)
+    return files
+
+def source_name(file, data_root=None):
+    """SOURCE_FILE tag of a source file: its path relative to ``data_root``.
+
+    Same-named files in different folders (such as a re-release) keep
+    distinct tags, and the tags order releases by path.
+    """
+    return os.path.relpath(os.path.abspath(file), data_root or DATA_ROOT).replace(os.sep, '/')
 
-def combine_files(pattern):
+def read_source_file(file, columns=None, data_root=None):
+    """Read one source file as strings, tagged with its SOURCE_FILE name.
+
+    When ``columns`` is given the frame is aligned to it, so missing columns
+    are left empty exactly as ``pd.concat`` would leave them.
+    """
+    name = os.path.basename(file)
+    with metrics.stage('parse', file=name) as record:
+        record['bytes_read'] = os.path.getsize(file)
+        df = pd.read_csv(file, dtype=str)
+        record['rows_out'] = len(df)
+    with metrics.stage('standardize', file=name) as record:
+        record['rows_in'] = len(df)
+        df = standardize_columns(df)
+        df['SOURCE_FILE'] = source_name(file, data_root)
+        if columns is not None:
+            df = df.reindex(columns=columns)
+        record['rows_out'] = len(df)
+    return df
+
+def file_failed(file, error):
+    """Report and count a source file that could not be read."""
+    print(f"Failed to read {file}: {error}")
+    metrics.count('files_failed')
+
+def combine_files(pattern, sketch_index=None, dataset_name=None):
     files = find_csv_files(pattern)
     dfs = []
     for file in files:
         try:
-            df = pd.read_csv(file, dtype=str)
-            df = standardize_columns(df)
-            df['SOURCE_FILE'] = os.path.basename(file)
-            dfs.append(df)
+            df = read_source_file(file)
+            if sketch_index is not None:
+                sketch_index.observe(dataset_name, df)
         except Exception as e:
-            print(f"Failed to read {file}: {e}")
+            file_failed(file, e)
+            continue
+        dfs.append(df)
+        metrics.count('files_read')
     if dfs:
         return pd.concat(dfs, ignore_index=True)
     else:
         return pd.DataFrame()
 
+def read_header(file):
+    """Read only the standardized header of a source file."""
+    header = pd.read_csv(file, dtype=str, nrows=0)
+    return standardize_columns(header).columns.tolist() + ['SOURCE_FILE']
+
+def fragment_name(file, data_root=None):
+    """Basename used for the parquet fragments written for a source file.
+
+    The file's name is suffixed with a hash of its path relative to
+    ``data_root``, so files of the same name in different folders (such as
+    a re-release) never overwrite each other's fragments.
+    """
+    digest = hashlib.blake2b(source_name(file, data_root).encode(), digest_size=4).hexdigest()
+    return f'{os.path.splitext(os.path.basename(file))[0]}-{digest}'
+
+
+def combined_header(files):
+    """Return the union of all file headers (in order of first appearance)
+    together with the files whose header could be read."""
+    columns = []
+    readable = []
+    for file in files:
+        try:
+            header = read_header(file)
+        except Exception as e:
+            file_failed(file, e)
+            continue
+        readable.append(file)
+        columns.extend(col for col in header if col not in columns)
+    return columns, readable
+
+def _sketch_source_file(df, file, dataset_name):
+    """Sketch one parsed source file for the parent (None when not sketching)."""
+    if dataset_name is None:
+        return None
+    with metrics.stage('sketch', file=os.path.basename(file)) as record:
+        record['rows_in'] = len(df)
+        index = sketches.SketchIndex()
+        index.observe(dataset_name, df)
+    return index
+
+def _format_source_file(file, columns, dataset_name=None, data_root=None):
+    """Parse one source file in a worker and return its rows as CSV text.
+
+    The worker's metrics records, and its ``SketchIndex`` when
+    ``dataset_name`` is given, are returned alongside for the parent.
+    ``data_root`` is the parent's, which a spawned worker would not see.
+    """
+    df = read_source_file(file, columns, data_root)
+    index = _sketch_source_file(df, file, dataset_name)
+    with metrics.stage('format', file=os.path.basename(file)) as record:
+        record['rows_in'] = len(df)
+        text = df.to_csv(index=False, header=False)
+    return text, len(df), index, metrics.take_records()
+
+def _write_source_fragment(file, columns, output_path, dataset_name=None, data_root=None):
+    """Parse one source file in a worker and write it as parquet fragments."""
+    df = read_source_file(file, columns, data_root)
+    index = _sketch_source_file(df, file, dataset_name)
+    # Cast to a uniform string type so every fragment has the same schema
+    df = df.astype('string')
+    with metrics.stage('write', file=os.path.basename(file)) as record:
+        record['rows_in'] = len(df)
+        storage.write_dataset(df, output_path, 'parquet', append=True, basename=fragment_name(file, data_root))
+    return len(df), index, metrics.take_records()
+
+def stream_combine_files(pattern, output_path, workers=None, max_in_flight=None, fmt='csv',
+                         sketch_index=None, dataset_name=None):
+    """Combine matching files into ``output_path`` using a process pool.
+
+    Files are parsed concurrently and written in sorted path order as soon as
+    the next one in line is ready. At most ``max_in_flight`` parsed files are
+    held at once, so peak memory depends on the queue size rather than on the
+    number of files. With ``fmt='parquet'`` each worker writes its file's
+    YEAR/MONTH partition fragments directly. With a ``sketch_index`` the
+    workers also sketch each file's rows under ``dataset_name`` and the
+    parent merges them in. Returns the number of rows written.
+    """
+    sketch_name = dataset_name if sketch_index is not None else None
+    if fmt == 'parquet':
+        return _stream_to_parquet(pattern, output_path, workers, sketch_index, sketch_name)
+
+    files = find_csv_files(pattern)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+
+    columns, readable = combined_header(files)
+
+    rows = 0
+    storage.remove_other_formats(output_path, 'csv')
+    with open(output_path, 'w', newline='') as out:
+        out.write(pd.DataFrame(columns=columns).to_csv(index=False))
+        if not readable:
+            return rows
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            queue = iter(readable)
+            for file in queue:
+                pending.append((file, pool.submit(_format_source_file, file, columns, sketch_name,
+                                                  DATA_ROOT)))
+                if len(pending) >= max_in_flight:
+                    break
+            while pending:
+                file, future = pending.popleft()
+                try:
+                    text, n, index, records = future.result()
+                except Exception as e:
+                    file_failed(file, e)
+                else:
+                    metrics.add_records(records)
+                    if index is not None:
+                        sketch_index.merge(index)
+                    with metrics.stage('write', file=os.path.basename(file)) as record:
+                        out.write(text)
+                        record['rows_in'] = record['rows_out'] = n
+                        record['bytes_written'] = len(text.encode())
+                    rows += n
+                    metrics.count('files_read')
+                next_file = next(queue, None)
+                if next_file is not None:
+                    pending.append((next_file, pool.submit(_format_source_file, next_file, columns,
+                                                           sketch_name, DATA_ROOT)))
+    return rows
+
+def _stream_to_parquet(pattern, output_path, workers=None, sketch_index=None, sketch_name=None):
+    """Write every matching file as parquet fragments from the process pool."""
+    files = find_csv_files(pattern)
+    storage.require_pyarrow()
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+    storage.remove_other_formats(output_path, 'parquet')
+
+    columns, readable = combined_header(files)
+
+    rows = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [(file, pool.submit(_write_source_fragment, file, columns, output_path, sketch_name,
+                                              DATA_ROOT))
+                   for file in readable]
+        for file, future in futures:
+            try:
+                n, index, records = future.result()
+            except Exception as e:
+                file_failed(file, e)
+            else:
+                metrics.add_records(records)
+                if index is not None:
+                    sketch_index.merge(index)
+                rows += n
+                metrics.count('files_read')
+    return rows
+
 if __name__ == "__main__":
-    # Combine dot1_*.csv
-    print("Combining dot1_*.csv files...")
-    dot1_all = combine_files('dot1_*.csv')
-    dot1_all.to_csv(os.path.join(OUTPUT_DIR, 'dot1_all.csv'), index=False)
-    print(f"Saved dot1_all.csv with shape {dot1_all.shape}")
-
-    # Combine dot2_*.csv
-    print("Combining dot2_*.csv files...")
-    dot2_all = combine_files('dot2_*.csv')
-    dot2_all.to_csv(os.path.join(OUTPUT_DIR, 'dot2_all.csv'), index=False)
-    print(f"Saved dot2_all.csv with shape {dot2_all.shape}")
-
-    # Combine dot3_*.csv
-    print("Combining dot3_*.csv files...")
-    dot3_all = combine_files('dot3_*.csv')
-    dot3_all.to_csv(os.path.join(OUTPUT_DIR, 'dot3_all.csv'), index=False)
-    print(f"Saved dot3_all.csv with shape {dot3_all.shape}") 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Combine monthly dot1/dot2/dot3 files.")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="Load every file and concatenate in memory instead of streaming")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of parser processes (default: CPU count)")
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help="Maximum number of parsed files held at once (default: 2 x workers)")
+    parser.add_argument('--format', choices=storage.FORMATS, default='csv',
+                        help="Output format; parquet is partitioned by YEAR/MONTH")
+    parser.add_argument('--metrics', default=None,
+                        help="Write per-stage timing/row/byte metrics to this path")
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json')
+    args = parser.parse_args()
+
+    # Ensure output directory exists
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # Per-month top-N sketches of every dataset, maintained while ingesting
+    sketch_index = sketches.SketchIndex()
+    for dataset in ['dot1', 'dot2', 'dot3']:
+        print(f"Combining {dataset}_*.csv files...")
+        output_path = storage.dataset_path(OUTPUT_DIR, f'{dataset}_all', args.format)
+        name = os.path.basename(output_path)
+        if args.in_memory:
+            combined = combine_files(f'{dataset}_*.csv', sketch_index, dataset)
+            with metrics.stage('write', file=name) as record:
+                storage.write_dataset(combined, output_path, args.format)
+                record['rows_in'] = rows = len(combined)
+                record['bytes_written'] = metrics.path_size(output_path)
+            print(f"Saved {name} with shape {combined.shape}")
+        else:
+            rows = stream_combine_files(f'{dataset}_*.csv', output_path,
+                                        workers=args.workers, max_in_flight=args.max_in_flight,
+                                        fmt=args.format, sketch_index=sketch_index, dataset_name=dataset)
+            print(f"Saved {name} with {rows} rows")
+        metrics.count('rows_written', rows)
+    sketches.save_index(sketch_index, OUTPUT_DIR)
+
+    if args.metrics:
+        metrics.write_report(args.metrics, args.metrics_format)
@@ -0,0 +1,148 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from codebooks import COLUMN_MAPPINGS, NULL_REPRESENTATIONS, compiled_mapping
+
+INDEX_NAME = 'coverage_index.json'
+REPORT_NAME = 'coverage_report.json'
+
+# Measure whose total is reported for each unmapped code
+VALUE_COLUMN = 'VALUE'
+
+class CoverageIndex:
+    """Row count and Trade_Value total of every distinct raw code per mapped column.
+
+    Laid out as ``{dataset: {column: {code: [rows, trade_value]}}}``. Indexes
+    are plain sums, so the index of a whole dataset is the ``merge`` of the
+    indexes of its files or chunks, and can be rebuilt from the per-file
+    indexes without rescanning the data.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = counts or {}
+
+    def observe(self, dataset_name, column, uniques, codes, weights=None):
+        """Add a factorized column: ``codes`` index ``uniques``, -1 means missing.
+
+        ``weights`` is the row-aligned Trade_Value array (or None).
+        """
+        valid = codes >= 0
+        rows = np.bincount(codes[valid], minlength=len(uniques))
+        if weights is not None:
+            value = np.bincount(codes[valid], weights=weights[valid], minlength=len(uniques))
+        else:
+            value = np.zeros(len(uniques))
+        entries = self.counts.setdefault(dataset_name, {}).setdefault(column, {})
+        for code, n, v in zip(uniques, rows.tolist(), value.tolist()):
+            self._add(entries, str(code), n, v)
+        missing = int((~valid).sum())
+        if missing:
+            # Missing cells are recorded under the empty-string null spelling
+            self._add(entries, '', missing, float(weights[~valid].sum()) if weights is not None else 0.0)
+
+    @staticmethod
+    def _add(entries, code, rows, value):
+        entry = entries.setdefault(code, [0, 0.0])
+        entry[0] += rows
+        entry[1] += value
+
+    def merge(self, other):
+        """Add another index's counts to this one and return self."""
+        for dataset_name, columns in other.counts.items():
+            for column, entries in columns.items():
+                target = self.counts.setdefault(dataset_name, {}).setdefault(column, {})
+                for code, (rows, value) in entries.items():
+                    self._add(target, code, rows, value)
+        return self
+
+    def to_dict(self):
+        return self.counts
+
+    @classmethod
+    def from_dict(cls, counts):
+        return cls({dataset_name: {column: {code: list(entry) for code, entry in entries.items()}
+                                   for column, entries in columns.items()}
+                    for dataset_name, columns in counts.items()})
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        """Write the index as JSON (atomically)."""
+        _write_json(self.counts, path)
+        return path
+
+def trade_values(df):
+    """Row-aligned Trade_Value weights for ``observe``, or None without a VALUE column."""
+    if VALUE_COLUMN not in df.columns:
+        return None
+    return pd.to_numeric(df[VALUE_COLUMN], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+def report(index, top=20):
+    """Mapped vs unmapped counts and the top unmapped codes of every indexed column.
+
+    Codes are checked against the current codebooks, so a report rebuilt from
+    an old index reflects codes added to ``MAPPINGS`` since.
+    """
+    result = {}
+    for dataset_name, columns in sorted(index.counts.items()):
+        for column, entries in sorted(columns.items()):
+            if column not in COLUMN_MAPPINGS:
+                continue
+            lookup, _ = compiled_mapping(COLUMN_MAPPINGS[column])
+            rows = mapped = nulls = 0
+            unmapped = []
+            for code, (n, value) in entries.items():
+                rows += n
+                if code in NULL_REPRESENTATIONS:
+                    nulls += n
+                elif code in lookup:
+                    mapped += n
+                else:
+                    unmapped.append({'code': code, 'rows': n, 'trade_value': value})
+            unmapped_rows = rows - mapped - nulls
+            result.setdefault(dataset_name, {})[column] = {
+                'mapping': COLUMN_MAPPINGS[column],
+                'distinct_codes': len(entries),
+                'rows': rows,
+                'mapped_rows': mapped,
+                'null_rows': nulls,
+                'unmapped_rows': unmapped_rows,
+                'unmapped_codes': len(unmapped),
+                'coverage': round(mapped / (rows - nulls), 6) if rows > nulls else None,
+                'top_unmapped_by_rows': sorted(unmapped, key=lambda e: (-e['rows'], e['code']))[:top],
+                'top_unmapped_by_value': sorted(unmapped, key=lambda e: (-e['trade_value'], e['code']))[:top],
+            }
+    return result
+
+def write_report(index, path, top=20):
+    _write_json(report(index, top), path)
+    return path
+
+def _write_json(data, path):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge coverage indexes and report unmapped codes.")
+    parser.add_argument('indexes', nargs='+', help="coverage_index.json files to merge")
+    parser.add_argument('--output', default=REPORT_NAME)
+    parser.add_argument('--merged-index', default=None, help="Also save the merged index here")
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    merged = CoverageIndex()
+    for path in args.indexes:
+        merged.merge(CoverageIndex.load(path))
+    if args.merged_index:
+        merged.save(args.merged_index)
+    write_report(merged, args.output, args.top)
+    print(f"Wrote {args.output}")
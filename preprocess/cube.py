@@ -0,0 +1,166 @@
+import os
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+import derive
+import renaming_mappin
+import storage
+from codebooks import MAPPINGS
+
+logger = logging.getLogger(__name__)
+
+CUBE_DIR = os.path.join(renaming_mappin.OUTPUT_DIR, 'cubes')
+
+# Additive measures kept for every cell: the sum and non-null count of each,
+# so sums, counts and means can all be rolled up exactly
+MEASURES = ('Weight', 'Trade_Value', 'Freight_Charges', 'Cost_per_Weight')
+
+# Grouping sets materialized per dataset (sets whose columns are missing from
+# a dataset are skipped). Every set keeps Year/Month so any of them can also
+# answer Period rollups.
+DIMENSION_SETS = {
+    'mode': ('Year', 'Month', 'Mode_of_Transport'),
+    'state_mode': ('Year', 'Month', 'US_State', 'Mode_of_Transport'),
+    'port_mode': ('Year', 'Month', 'Port_District', 'Mode_of_Transport'),
+    'country_mode': ('Year', 'Month', 'Country', 'Mode_of_Transport'),
+    'container_mode': ('Year', 'Month', 'Container_Code', 'Mode_of_Transport'),
+    'commodity_mode': ('Year', 'Month', 'Commodity_Code', 'Mode_of_Transport'),
+}
+
+# Month labels produced by month_map, in calendar order
+MONTH_NUMBERS = {label: int(code) for code, label in MAPPINGS['month_map'].items()}
+
+def add_cost_per_weight(df):
+    """Add the notebook's per-row Cost_per_Weight (zero weights give NaN).
+
+    Outputs of the derivation stage already carry it and are returned as is.
+    """
+    if 'Cost_per_Weight' in df.columns:
+        return df
+    freight = pd.to_numeric(df['Freight_Charges'], errors='coerce')
+    weight = pd.to_numeric(df['Weight'], errors='coerce')
+    df['Cost_per_Weight'] = derive.ratio(freight, weight)
+    return df
+
+def build_cube(df):
+    """Materialize sum/count aggregates of ``MEASURES`` over every grouping set.
+
+    Returns ``{set_name: DataFrame}`` where each frame has the set's
+    dimensions, ``<measure>_sum`` and ``<measure>_count`` columns and a
+    ``Records`` row count.
+    """
+    if 'Cost_per_Weight' not in df.columns and {'Freight_Charges', 'Weight'} <= set(df.columns):
+        df = add_cost_per_weight(df.copy())
+    measures = [m for m in MEASURES if m in df.columns]
+    values = pd.DataFrame({m: pd.to_numeric(df[m], errors='coerce') for m in measures}, index=df.index)
+
+    cube = {}
+    for name, dims in DIMENSION_SETS.items():
+        if not set(dims) <= set(df.columns):
+            continue
+        grouped = values.groupby([df[d] for d in dims], dropna=False, observed=True)
+        agg = grouped.agg(['sum', 'count'])
+        agg.columns = [f'{measure}_{stat}' for measure, stat in agg.columns]
+        agg['Records'] = grouped.size()
+        cube[name] = agg.reset_index()
+    return cube
+
+def save_cube(cube, dataset_name, directory=None, fmt='csv'):
+    directory = directory or CUBE_DIR
+    os.makedirs(directory, exist_ok=True)
+    for name, agg in cube.items():
+        path = storage.dataset_path(directory, f'{dataset_name}_{name}', fmt)
+        # Cubes are small; keep each grouping set in a single file
+        storage.write_dataset(agg, path, fmt, partition_cols=[])
+
+def load_cube(dataset_name, directory=None):
+    """Load every saved grouping set of a dataset's cube."""
+    directory = directory or CUBE_DIR
+    cube = {}
+    for name in DIMENSION_SETS:
+        for fmt in storage.FORMATS:
+            path = storage.dataset_path(directory, f'{dataset_name}_{name}', fmt)
+            if os.path.exists(path):
+                cube[name] = storage.read_dataset(path, fmt=fmt)
+                break
+    return cube
+
+def add_period(df):
+    """Add a monthly ``Period`` column built from Year and the mapped Month label.
+
+    Rows whose Year or Month cannot be placed (such as Month 'Unknown') get NaT.
+    """
+    # Imported here: timeseries itself imports this module
+    from timeseries import period_ordinals, to_periods
+    df['Period'] = to_periods(period_ordinals(df['Year'], df['Month']))
+    return df
+
+def query(cube, by, measure='Weight', agg='sum', filters=None):
+    """Answer a rollup of ``measure`` grouped by ``by`` from the cube.
+
+    ``by`` may include the virtual ``Period`` dimension; cells without a valid
+    period are left out of Period rollups. ``agg`` is one of
+    'sum', 'count', 'mean' or 'records'. ``filters`` is a dict of
+    ``{dimension: value or list of values}``. Uses the smallest grouping set
+    that covers the requested dimensions.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    filters = filters or {}
+    needed = set(by) | set(filters)
+    if 'Period' in needed:
+        needed = (needed - {'Period'}) | {'Year', 'Month'}
+
+    candidates = [agg_df for name, agg_df in cube.items() if needed <= set(DIMENSION_SETS[name])]
+    if not candidates:
+        raise KeyError(f"No grouping set in the cube covers {sorted(needed)}")
+    df = min(candidates, key=len)
+
+    for dim, value in filters.items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        df = df[df[dim].isin(values)]
+    if 'Period' in by:
+        df = add_period(df.copy())
+        df = df[df['Period'].notna()]
+
+    if agg == 'records':
+        columns = ['Records']
+    else:
+        columns = [f'{measure}_sum', f'{measure}_count']
+    rolled = df.groupby(by, dropna=False, observed=True)[columns].sum()
+
+    if agg == 'sum':
+        return rolled[f'{measure}_sum'].rename(measure)
+    if agg == 'count':
+        return rolled[f'{measure}_count'].rename(measure)
+    if agg == 'mean':
+        return (rolled[f'{measure}_sum'] / rolled[f'{measure}_count'].replace(0, np.nan)).rename(measure)
+    if agg == 'records':
+        return rolled['Records']
+    raise ValueError(f"Unknown aggregation {agg!r}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build aggregate cubes from the cleaned datasets.")
+    parser.add_argument('--datasets', nargs='+', choices=renaming_mappin.DATASETS,
+                        default=list(renaming_mappin.DATASETS))
+    parser.add_argument('--input-dir', default=renaming_mappin.OUTPUT_DIR)
+    parser.add_argument('--output-dir', default=CUBE_DIR)
+    parser.add_argument('--format', choices=storage.FORMATS, default='csv')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    for dataset_name in args.datasets:
+        path = (storage.find_dataset(args.input_dir, f'{dataset_name}_all_cleaned')
+                or storage.dataset_path(args.input_dir, f'{dataset_name}_all_cleaned', 'csv'))
+
+        # Only read the dimension and measure columns the cube needs
+        header = storage.read_columns(path)
+        wanted = {d for dims in DIMENSION_SETS.values() for d in dims} | set(MEASURES)
+        df = storage.read_dataset(path, columns=[c for c in header if c in wanted])
+
+        cube = build_cube(df)
+        save_cube(cube, dataset_name, args.output_dir, args.format)
+        logger.info(f"Built {dataset_name} cube: " + ", ".join(f"{k}={len(v)}" for k, v in cube.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import logging
+import numpy as np
+import pandas as pd
+import metrics
+from codebooks import NULL_REPRESENTATIONS
+
+logger = logging.getLogger(__name__)
+
+# Measures of the mapped datasets, parsed once here
+MEASURES = ('Trade_Value', 'Weight', 'Freight_Charges')
+
+# Derived metrics: name -> (numerator, denominator). Weight is SHIPWT in
+# kilograms, so the per-weight metrics are per kg. A zero, missing or
+# rejected denominator gives NaN, so means and sums skip those rows.
+DERIVED = {
+    'Cost_per_Weight': ('Freight_Charges', 'Weight'),
+    'Value_per_Weight': ('Trade_Value', 'Weight'),
+    'Freight_Share': ('Freight_Charges', 'Trade_Value'),
+}
+DERIVED_COLUMNS = tuple(DERIVED)
+
+def parse_measure(series):
+    """Strictly parse a measure column to float64.
+
+    Null spellings become NaN. Anything else that is not a finite,
+    non-negative number (text, 'inf', negative amounts) is rejected: it is
+    also set to NaN and flagged in the returned mask, so it can be counted
+    instead of silently coerced.
+    """
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.to_numpy(dtype='float64', na_value=np.nan, copy=True)
+        missing = np.isnan(values)
+    else:
+        text = series.astype('string').str.strip()
+        missing = (text.isna() | text.isin(NULL_REPRESENTATIONS)).to_numpy()
+        values = pd.to_numeric(text.mask(missing), errors='coerce')
+        values = values.to_numpy(dtype='float64', na_value=np.nan, copy=True)
+    with np.errstate(invalid='ignore'):
+        rejected = ~missing & ~(np.isfinite(values) & (values >= 0))
+    values[rejected] = np.nan
+    return pd.Series(values, index=series.index, name=series.name), rejected
+
+def whole_numbers(series):
+    """A parsed measure as nullable Int64 when every present value is whole.
+
+    Values, weights and charges are integers in the source files, and stay
+    so in the outputs (``9741``, not ``9741.0``). A column holding any
+    fractional value is returned unchanged, as float64.
+    """
+    values = series.to_numpy()
+    present = values[~np.isnan(values)]
+    if len(present) and not (np.array_equal(present, np.floor(present)) and present.max() < 2 ** 53):
+        return series
+    return series.astype('Int64')
+
+def ratio(numerator, denominator):
+    """``numerator / denominator`` with NaN wherever the denominator is not positive."""
+    return numerator / denominator.where(denominator > 0)
+
+def derive_measures(df, dataset_name):
+    """Parse the measures of a mapped frame in place and add the derived metrics.
+
+    The metrics are computed in float64; the measures are then kept as
+    integers where they are whole (see ``whole_numbers``). Returns
+    ``{measure: rejected count}``. The counts are also added to the 'derive'
+    metrics stage and the ``rejected_<measure>`` counters.
+    """
+    rejected = {}
+    with metrics.stage('derive', dataset=dataset_name) as record:
+        record['rows_in'] = len(df)
+        for col in MEASURES:
+            if col in df.columns:
+                df[col], mask = parse_measure(df[col])
+                rejected[col] = int(mask.sum())
+                if rejected[col]:
+                    metrics.count(f'rejected_{col}', rejected[col])
+        for name, (numerator, denominator) in DERIVED.items():
+            if numerator in df.columns and denominator in df.columns:
+                df[name] = ratio(df[numerator], df[denominator])
+        for col in MEASURES:
+            if col in df.columns:
+                df[col] = whole_numbers(df[col])
+        record['rows_out'] = len(df)
+        record['rejected'] = rejected
+    if any(rejected.values()):
+        logger.warning(f"{dataset_name}: rejected non-numeric or negative measures {rejected}")
+    return rejected
@@ -0,0 +1,359 @@
+import os
+import json
+import pickle
+import hashlib
+import inspect
+import logging
+import argparse
+import functools
+from collections import Counter
+import pandas as pd
+import derive
+import renaming_mappin
+import shared_cache
+import storage
+import timeseries
+
+logger = logging.getLogger(__name__)
+
+# Cleaned datasets read by the insights, and where their aggregates are cached
+DATA_DIR = renaming_mappin.OUTPUT_DIR
+CACHE_DIR = os.path.join(renaming_mappin.OUTPUT_DIR, 'analytics_cache')
+
+# Bump when an insight's computation changes so stale entries are never reused
+CACHE_VERSION = 3
+MAX_CACHE_ENTRIES = 256
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+def human_format(num, decimals=0):
+    """Format a number with a K/M/B/T suffix for chart labels, e.g. 1,200,000 -> '1M'."""
+    num = float(num)
+    for threshold, suffix in ((1e12, 'T'), (1e9, 'B'), (1e6, 'M'), (1e3, 'K')):
+        if abs(num) >= threshold:
+            return f"{num / threshold:.0f}{suffix}"
+    return f"{num:.{decimals}f}"
+
+def cleaned_path(dataset_name, data_dir=None):
+    """Path of a cleaned dataset, preferring its parquet form when present."""
+    data_dir = data_dir or DATA_DIR
+    return (storage.find_dataset(data_dir, f'{dataset_name}_all_cleaned')
+            or storage.dataset_path(data_dir, f'{dataset_name}_all_cleaned', 'csv'))
+
+class DiskCache:
+    """Pickled results in a directory, evicted least recently used first.
+
+    An entry's modification time is its last use; entries beyond
+    ``max_entries`` or ``max_bytes`` are removed oldest first.
+    """
+
+    def __init__(self, directory=None, max_entries=MAX_CACHE_ENTRIES, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory or CACHE_DIR
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def get(self, key):
+        """Return ``(True, value)`` on a hit, ``(False, None)`` on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        os.utime(path)
+        return True, value
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def entries(self):
+        """``(path, size, last_used)`` of every entry, most recently used first."""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2], reverse=True)
+
+    def evict(self):
+        total = 0
+        for i, (path, size, _) in enumerate(self.entries()):
+            total += size
+            if i >= self.max_entries or total > self.max_bytes:
+                os.remove(path)
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+cache = DiskCache()
+
+# Hits and misses of memoized insights in this process
+stats = Counter()
+
+def memoize(func):
+    """Cache an insight on disk, keyed by its arguments and its input dataset.
+
+    The decorated function must take a ``dataset`` argument naming the cleaned
+    dataset it reads; the key includes that dataset's fingerprint, so the
+    result is recomputed whenever the dataset is rewritten. Pass
+    ``refresh=True`` to recompute and overwrite the cached result.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, refresh=False, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        path = cleaned_path(params['dataset'])
+        key_data = json.dumps([CACHE_VERSION, func.__name__, storage.dataset_fingerprint(path), params],
+                              sort_keys=True, default=str)
+        key = hashlib.blake2b(key_data.encode(), digest_size=16).hexdigest()
+
+        if not refresh:
+            hit, value = cache.get(key)
+            if hit:
+                stats['hits'] += 1
+                return value
+        stats['misses'] += 1
+        value = func(*bound.args, **bound.kwargs)
+        cache.put(key, value)
+        return value
+
+    return wrapper
+
+def load(dataset_name, columns):
+    """Read only the given columns of a cleaned dataset.
+
+    Served from the memory-mapped shared cache when its published build
+    matches the cleaned dataset on disk. Derived metrics missing from
+    datasets written before the derivation stage are computed here.
+    """
+    path = cleaned_path(dataset_name)
+    columns = list(columns)
+    available = storage.read_columns(path)
+    missing = [col for col in columns if col in derive.DERIVED and col not in available]
+    read = [col for col in columns if col not in missing]
+    read += [col for name in missing for col in derive.DERIVED[name] if col not in read]
+
+    shared = shared_cache.SharedDatasets()
+    if shared.is_current(dataset_name, path):
+        df = shared.read(dataset_name, columns=read)
+    else:
+        df = storage.read_dataset(path, columns=read)
+    # Outputs written before the derivation stage may hold the measures as text
+    for col in derive.MEASURES + derive.DERIVED_COLUMNS:
+        if col in df.columns and not pd.api.types.is_float_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    for name in missing:
+        numerator, denominator = derive.DERIVED[name]
+        df[name] = derive.ratio(df[numerator], df[denominator])
+    return df[columns]
+
+def timeseries_store(dataset_name):
+    """The dataset's saved ``TimeSeriesStore``, rebuilt from the cleaned data if stale or missing."""
+    path = cleaned_path(dataset_name)
+    store = timeseries.TimeSeriesStore.load(dataset_name)
+    if store is None or store.source != storage.dataset_fingerprint(path):
+        logger.info(f"No current {dataset_name} time series in {timeseries.TIMESERIES_DIR}, rolling up {path}")
+        store = timeseries.build_store(path)
+    return store
+
+def _observed(series):
+    """Drop unused categories, so categorical labels count like CSV strings."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.remove_unused_categories()
+    return series
+
+def _route(df):
+    return (df['US_State'].astype(str) + '-' + df['Mexico_State'].astype(str) + '-' +
+            df['Canada_Province'].astype(str))
+
+@memoize
+def season_trend(measure='Weight', dataset='dot1'):
+    """Total of ``measure`` per monthly period, in calendar order."""
+    return timeseries_store(dataset).series('total', measure=measure)
+
+@memoize
+def mode_counts(dataset='dot1'):
+    """Number of records per mode of transport."""
+    df = load(dataset, ['Mode_of_Transport'])
+    return _observed(df['Mode_of_Transport']).value_counts().sort_values(ascending=False)
+
+@memoize
+def top_states_by_mode(n=10, dataset='dot1'):
+    """Records per mode for the ``n`` states with the most records."""
+    df = load(dataset, ['US_State', 'Mode_of_Transport'])
+    top = _observed(df['US_State']).value_counts().head(n).index
+    df = df[df['US_State'].isin(top)]
+    return pd.crosstab(_observed(df['US_State']), _observed(df['Mode_of_Transport'])).loc[top]
+
+@memoize
+def mode_trends(measure='Weight', dataset='dot1'):
+    """Monthly total of ``measure`` per mode, indexed by the first day of the month."""
+    trends = timeseries_store(dataset).frame('mode', measure).copy()
+    trends.index = trends.index.to_timestamp()
+    return trends
+
+@memoize
+def revenue_share_by_mode(threshold=2.0, dataset='dot2'):
+    """Percent of Trade_Value per mode, with modes below ``threshold`` percent grouped."""
+    df = load(dataset, ['Mode_of_Transport', 'Trade_Value'])
+    revenue = df.groupby('Mode_of_Transport', observed=True)['Trade_Value'].sum().sort_values(ascending=False)
+    pct = revenue / revenue.sum() * 100
+    significant = pct[pct >= threshold]
+    other = pct[pct < threshold]
+    if other.empty:
+        return pct
+    label = "Other Modes (" + ", ".join(
+        str(mode)[:15] + ('...' if len(str(mode)) > 15 else '') for mode in other.index
+    ) + ")"
+    return pd.concat([significant, pd.Series([other.sum()], index=[label])])
+
+@memoize
+def cost_per_weight_by_mode(dataset='dot2'):
+    """Mean Cost_per_Weight per mode, highest first."""
+    df = load(dataset, ['Mode_of_Transport', 'Cost_per_Weight'])
+    return df.groupby('Mode_of_Transport', observed=True)['Cost_per_Weight'].mean().sort_values(ascending=False)
+
+@memoize
+def inefficient_routes(n=3, dataset='dot2'):
+    """The ``n`` mode-route pairs with the highest mean Cost_per_Weight."""
+    df = load(dataset, ['Mode_of_Transport', 'US_State', 'Mexico_State', 'Canada_Province',
+                        'Cost_per_Weight'])
+    df['Route'] = _route(df)
+    return (df.groupby(['Mode_of_Transport', 'Route'], observed=True)['Cost_per_Weight']
+            .mean().sort_values(ascending=False).head(n).reset_index())
+
+@memoize
+def underutilized_routes(n=5, dataset='dot2'):
+    """Routes in the bottom shipment-count quartile with below-median Cost_per_Weight."""
+    df = load(dataset, ['US_State', 'Mexico_State', 'Canada_Province', 'Freight_Charges',
+                        'Cost_per_Weight'])
+    df['Route'] = _route(df)
+    metrics = df.groupby('Route', observed=True).agg({
+        'Cost_per_Weight': 'mean',
+        'Freight_Charges': 'count',
+    }).rename(columns={'Freight_Charges': 'Shipment_Count'}).reset_index()
+    selected = metrics[
+        (metrics['Shipment_Count'] < metrics['Shipment_Count'].quantile(0.25)) &
+        (metrics['Cost_per_Weight'] < metrics['Cost_per_Weight'].median())
+    ]
+    return selected.sort_values(by='Cost_per_Weight').head(n)
+
+@memoize
+def top_commodities(n=10, by='count', dataset='dot2'):
+    """Top ``n`` commodities by record ``count`` or by total Trade_Value (``by='value'``)."""
+    if by == 'count':
+        df = load(dataset, ['Commodity_Code'])
+        return _observed(df['Commodity_Code']).value_counts().head(n)
+    if by != 'value':
+        raise ValueError(f"Unknown ranking {by!r}, expected 'count' or 'value'")
+    df = load(dataset, ['Commodity_Code', 'Trade_Value'])
+    return df.groupby('Commodity_Code', observed=True)['Trade_Value'].sum().sort_values(ascending=False).head(n)
+
+@memoize
+def cross_border(measure='Weight', dataset='dot3'):
+    """Total of ``measure`` per partner country and mode."""
+    df = load(dataset, ['Country', 'Mode_of_Transport', measure])
+    return df.groupby(['Country', 'Mode_of_Transport'], observed=True)[measure].sum().unstack(fill_value=0)
+
+@memoize
+def seasonal_by_mode(measure='Weight', dataset='dot1'):
+    """Total of ``measure`` per monthly period and mode."""
+    return timeseries_store(dataset).frame('mode', measure)
+
+@memoize
+def weight_vs_value(dataset='dot1'):
+    """Monthly Weight and Trade_Value totals, each also normalized to its maximum."""
+    store = timeseries_store(dataset)
+    movement = pd.DataFrame({measure: store.series('total', measure=measure)
+                             for measure in ('Weight', 'Trade_Value')})
+    movement['Weight_norm'] = movement['Weight'] / movement['Weight'].max()
+    movement['Trade_Value_norm'] = movement['Trade_Value'] / movement['Trade_Value'].max()
+    return movement
+
+@memoize
+def top_ports(measure='Weight', agg='sum', n=10, dataset='dot1'):
+    """Top ``n`` port districts by the ``agg`` ('sum' or 'mean') of ``measure``."""
+    df = load(dataset, ['Port_District', measure])
+    return df.groupby('Port_District', observed=True)[measure].agg(agg).sort_values(ascending=False).head(n)
+
+@memoize
+def container_trade_value(dataset='dot1'):
+    """Mean Trade_Value per container type and mode."""
+    df = load(dataset, ['Container_Code', 'Mode_of_Transport', 'Trade_Value'])
+    return (df.groupby(['Container_Code', 'Mode_of_Transport'], observed=True)['Trade_Value']
+            .mean().unstack().fillna(0))
+
+@memoize
+def best_mode_per_country(dataset='dot2'):
+    """The mode with the lowest mean Cost_per_Weight for each country."""
+    df = load(dataset, ['Country', 'Mode_of_Transport', 'Cost_per_Weight'])
+    efficiency = (df.groupby(['Country', 'Mode_of_Transport'], observed=True)['Cost_per_Weight']
+                  .mean().reset_index())
+    best = efficiency.loc[efficiency.groupby('Country', observed=True)['Cost_per_Weight'].idxmin().dropna()]
+    return best.sort_values(by='Cost_per_Weight')
+
+# Every insight with the arguments the notebook uses, for warming the cache
+NOTEBOOK_INSIGHTS = [
+    (season_trend, {'measure': 'Weight'}),
+    (season_trend, {'measure': 'Trade_Value'}),
+    (mode_counts, {}),
+    (top_states_by_mode, {}),
+    (mode_trends, {}),
+    (revenue_share_by_mode, {}),
+    (cost_per_weight_by_mode, {}),
+    (inefficient_routes, {}),
+    (underutilized_routes, {}),
+    (top_commodities, {'by': 'count'}),
+    (top_commodities, {'by': 'value'}),
+    (cross_border, {}),
+    (seasonal_by_mode, {'measure': 'Weight', 'dataset': 'dot1'}),
+    (seasonal_by_mode, {'measure': 'Freight_Charges', 'dataset': 'dot2'}),
+    (weight_vs_value, {}),
+    (top_ports, {'measure': 'Weight'}),
+    (top_ports, {'measure': 'Trade_Value'}),
+    (top_ports, {'measure': 'Weight', 'agg': 'mean'}),
+    (container_trade_value, {}),
+    (best_mode_per_country, {}),
+]
+
+def warm(refresh=False):
+    """Compute (or reuse) every notebook insight; returns the number computed."""
+    misses = stats['misses']
+    for func, kwargs in NOTEBOOK_INSIGHTS:
+        try:
+            func(refresh=refresh, **kwargs)
+        except (KeyError, FileNotFoundError) as e:
+            # Datasets or columns that were not produced are skipped
+            logger.warning(f"Skipping {func.__name__}({kwargs}): {e}")
+    return stats['misses'] - misses
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the cached aggregates behind the EDA notebook.")
+    parser.add_argument('action', choices=['warm', 'clear', 'stats'])
+    parser.add_argument('--refresh', action='store_true', help="Recompute cached insights when warming")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.action == 'warm':
+        print(f"Computed {warm(args.refresh)} of {len(NOTEBOOK_INSIGHTS)} insights")
+    elif args.action == 'clear':
+        cache.clear()
+        print(f"Cleared {cache.directory}")
+    else:
+        entries = cache.entries()
+        print(f"{len(entries)} entries, {sum(size for _, size, _ in entries) / 1e6:.1f} MB in {cache.directory}")
@@ -0,0 +1,371 @@
+import os
+import sys
+import json
+import glob
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import combining
+import codebooks
+import coverage
+import derive
+import renaming_mappin
+import sketches
+import storage
+
+logger = logging.getLogger(__name__)
+
+# The build manifest lives next to the combined datasets
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 2
+
+# Outputs maintained per source file: the combined rows, and the cleaned and
+# enriched outputs of renaming_mappin
+BUILD_STAGES = ('combined',) + renaming_mappin.STAGES
+
+# Mapped columns written as float64 (whole-valued measures included); every
+# other column is a string so the fragments of every run share one schema
+NUMERIC_COLUMNS = derive.MEASURES + derive.DERIVED_COLUMNS
+
+def file_hash(path, block_size=1 << 20):
+    """Content hash of a source file."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def build_key():
+    """What a per-file output was built with: the codebook content and the
+    mapping pipeline version. Entries built with another key are rebuilt."""
+    return {'codebooks': codebooks.codebook_hash(), 'pipeline': renaming_mappin.PIPELINE_VERSION}
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {'version': MANIFEST_VERSION, 'datasets': {}}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version in {path}; rebuild with --force")
+    return manifest
+
+def save_manifest(manifest, path):
+    """Write the manifest atomically so an interrupted run never corrupts it."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def stage_paths(dataset_name, combined_dir, output_dir):
+    """Parquet dataset directories for each build stage of a dataset."""
+    return {
+        'combined': storage.dataset_path(combined_dir, f'{dataset_name}_all', 'parquet'),
+        'cleaned': storage.dataset_path(output_dir, f'{dataset_name}_all_cleaned', 'parquet'),
+        'enriched': storage.dataset_path(output_dir, f'{dataset_name}_all_enriched', 'parquet'),
+    }
+
+def _written_fragments(root, basename):
+    pattern = os.path.join(root, '**', f'{glob.escape(basename)}-*.parquet')
+    return sorted(os.path.relpath(path, root) for path in glob.glob(pattern, recursive=True))
+
+def drop_fragments(root, fragments):
+    """Delete fragment files and any partition directories left empty."""
+    for fragment in fragments:
+        path = os.path.join(root, fragment)
+        if os.path.exists(path):
+            os.remove(path)
+        parent = os.path.dirname(path)
+        while parent != root and os.path.isdir(parent) and not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+def file_sketch_dir(combined_dir, dataset_name):
+    """Directory of the per-source-file sketch indexes, next to the combined datasets."""
+    return os.path.join(combined_dir, sketches.SKETCH_DIR_NAME, 'files', dataset_name)
+
+def file_sketch_path(combined_dir, dataset_name, basename):
+    return os.path.join(file_sketch_dir(combined_dir, dataset_name), f'{basename}.json')
+
+def drop_file_sketch(combined_dir, entry):
+    if entry.get('sketches'):
+        path = os.path.join(combined_dir, entry['sketches'])
+        if os.path.exists(path):
+            os.remove(path)
+
+def fragment_frame(df):
+    """Cast a stage frame to the fragment schema (see ``NUMERIC_COLUMNS``).
+
+    The raw columns of the combined stage and of the enriched output all
+    become strings.
+    """
+    return df.astype({col: 'float64' if col in NUMERIC_COLUMNS else 'string' for col in df.columns})
+
+def build_source_file(file, dataset_name, paths, data_root=None):
+    """Parse, map and append one source file to every stage output.
+
+    Fragments and the sketch are named by ``combining.fragment_name``, which
+    is unique per path under ``data_root``. Returns its manifest entry
+    (without the hash), including the file's raw code coverage index and
+    the path of its top-N sketch index.
+    """
+    basename = combining.fragment_name(file, data_root)
+    df = combining.read_source_file(file, data_root=data_root)
+    index = coverage.CoverageIndex()
+    df_mapped = renaming_mappin.apply_mappings(df, dataset_name, index)
+    enriched = renaming_mappin.enrich_data(df, df_mapped, dataset_name)
+
+    frames = {'combined': df, 'cleaned': df_mapped, 'enriched': enriched}
+    fragments = {}
+    for stage in BUILD_STAGES:
+        storage.write_dataset(fragment_frame(frames[stage]), paths[stage], 'parquet',
+                              append=True, basename=basename)
+        fragments[stage] = _written_fragments(paths[stage], basename)
+
+    combined_dir = os.path.dirname(paths['combined'])
+    sketch = sketches.SketchIndex()
+    sketch.observe(dataset_name, df)
+    sketch_path = file_sketch_path(combined_dir, dataset_name, basename)
+    os.makedirs(os.path.dirname(sketch_path), exist_ok=True)
+    sketch.save(sketch_path)
+
+    partitions = sorted({os.path.dirname(fragment) for fragment in fragments['combined']})
+    return {'rows': len(df), 'partitions': partitions, 'fragments': fragments,
+            'coverage': index.counts.get(dataset_name, {}),
+            'sketches': os.path.relpath(sketch_path, combined_dir)}
+
+def build(datasets=renaming_mappin.DATASETS, force=False, data_root=None,
+          combined_dir=None, output_dir=None):
+    """Incrementally bring the parquet outputs in line with the source files.
+
+    Only new or changed source files (by content hash) are parsed and mapped,
+    plus every file whose outputs were built with other codebooks or another
+    ``PIPELINE_VERSION`` (see ``build_key``); the outputs of deleted files
+    are dropped. ``force`` discards the manifest
+    entries and outputs of ``datasets`` and rebuilds them from scratch.
+    Returns a per-dataset summary.
+    """
+    data_root = data_root or combining.DATA_ROOT
+    combined_dir = combined_dir or combining.OUTPUT_DIR
+    output_dir = output_dir or renaming_mappin.OUTPUT_DIR
+    storage.require_pyarrow()
+    os.makedirs(combined_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest_path = os.path.join(combined_dir, MANIFEST_NAME)
+    if force:
+        try:
+            manifest = load_manifest(manifest_path)
+        except ValueError:
+            # Outputs of another manifest version may not share the current
+            # fragment schema, so every dataset is rebuilt
+            logger.warning(f"Rebuilding every dataset over the outdated manifest {manifest_path}")
+            manifest = {'version': MANIFEST_VERSION, 'datasets': {}}
+            datasets = renaming_mappin.DATASETS
+        # Only the forced datasets start over; the others keep their entries
+        for dataset_name in datasets:
+            manifest['datasets'].pop(dataset_name, None)
+    else:
+        manifest = load_manifest(manifest_path)
+
+    key = build_key()
+    summary = {}
+    for dataset_name in datasets:
+        paths = stage_paths(dataset_name, combined_dir, output_dir)
+        if force:
+            for path in list(paths.values()) + [file_sketch_dir(combined_dir, dataset_name)]:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+        for path in paths.values():
+            storage.remove_other_formats(path, 'parquet')
+        entries = manifest['datasets'].setdefault(dataset_name, {})
+        counts = {'added': 0, 'changed': 0, 'unchanged': 0, 'deleted': 0, 'failed': 0}
+
+        sources = {os.path.relpath(file, data_root): file
+                   for file in combining.find_csv_files(f'{dataset_name}_*.csv', data_root)}
+
+        for rel in sorted(set(entries).difference(sources)):
+            logger.info(f"Dropping outputs of deleted file {rel}")
+            for stage, fragments in entries[rel]['fragments'].items():
+                drop_fragments(paths[stage], fragments)
+            drop_file_sketch(combined_dir, entries[rel])
+            del entries[rel]
+            counts['deleted'] += 1
+
+        for rel, file in sources.items():
+            digest = file_hash(file)
+            entry = entries.get(rel)
+            if entry is not None and entry['hash'] == digest and entry.get('build') == key:
+                counts['unchanged'] += 1
+                continue
+            if entry is not None:
+                if entry['hash'] == digest:
+                    logger.info(f"Rebuilding {rel}: the codebooks or the mapping pipeline changed")
+                for stage, fragments in entry['fragments'].items():
+                    drop_fragments(paths[stage], fragments)
+                drop_file_sketch(combined_dir, entry)
+                del entries[rel]
+
+            logger.info(f"Building {rel}")
+            try:
+                entries[rel] = dict(build_source_file(file, dataset_name, paths, data_root),
+                                    hash=digest, build=key)
+            except Exception as e:
+                logger.warning(f"Failed to build {file}: {e}")
+                basename = combining.fragment_name(file, data_root)
+                for stage in BUILD_STAGES:
+                    drop_fragments(paths[stage], _written_fragments(paths[stage], basename))
+                counts['failed'] += 1
+                continue
+            finally:
+                save_manifest(manifest, manifest_path)
+            counts['changed' if entry is not None else 'added'] += 1
+
+        save_manifest(manifest, manifest_path)
+        summary[dataset_name] = counts
+        logger.info(f"{dataset_name}: {counts}")
+
+    write_coverage(manifest, output_dir)
+    write_sketches(manifest, combined_dir)
+    return summary
+
+def write_coverage(manifest, output_dir):
+    """Merge the per-file coverage indexes of the manifest and report unmapped codes.
+
+    Deleted and changed files have already been replaced in the manifest, so
+    the merged index always matches the current outputs.
+    """
+    index = coverage.CoverageIndex()
+    for dataset_name, entries in manifest['datasets'].items():
+        for entry in entries.values():
+            # Entries written before coverage was tracked have no index
+            index.merge(coverage.CoverageIndex({dataset_name: entry.get('coverage', {})}))
+    index.save(os.path.join(output_dir, coverage.INDEX_NAME))
+    coverage.write_report(index, os.path.join(output_dir, coverage.REPORT_NAME))
+    return index
+
+def write_sketches(manifest, combined_dir):
+    """Merge the per-file sketch indexes of the manifest into one file per dataset."""
+    index = sketches.SketchIndex()
+    for entries in manifest['datasets'].values():
+        for entry in entries.values():
+            # Entries written before sketches were kept have none
+            if entry.get('sketches'):
+                index.merge(sketches.SketchIndex.load(os.path.join(combined_dir, entry['sketches'])))
+    sketches.save_index(index, combined_dir)
+    return index
+
+def _fragment_rows(root, fragment):
+    """Row count of one parquet fragment, from its footer."""
+    pa = storage.require_pyarrow()
+    return pa.parquet.read_metadata(os.path.join(root, fragment)).num_rows
+
+def _read_for_compare(path):
+    """A stage output with its columns and rows in a canonical order."""
+    df = storage.read_dataset(path)
+    df = df.astype({col: 'string' for col in df.columns if col not in NUMERIC_COLUMNS})
+    df = df.sort_index(axis=1)
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+def compare_with_rebuild(datasets=renaming_mappin.DATASETS, data_root=None, combined_dir=None,
+                         output_dir=None):
+    """Compare the contents of every stage output with a full rebuild.
+
+    Rebuilds the datasets from scratch in a temporary directory, so stale
+    labels or measures are caught too. Returns ``(dataset, stage, problem)``.
+    """
+    combined_dir = combined_dir or combining.OUTPUT_DIR
+    output_dir = output_dir or renaming_mappin.OUTPUT_DIR
+    mismatches = []
+    with tempfile.TemporaryDirectory() as tmp:
+        rebuilt_dirs = os.path.join(tmp, 'combined'), os.path.join(tmp, 'output')
+        build(datasets, force=True, data_root=data_root, combined_dir=rebuilt_dirs[0],
+              output_dir=rebuilt_dirs[1])
+        for dataset_name in datasets:
+            current = stage_paths(dataset_name, combined_dir, output_dir)
+            rebuilt = stage_paths(dataset_name, *rebuilt_dirs)
+            for stage in BUILD_STAGES:
+                if os.path.isdir(current[stage]) != os.path.isdir(rebuilt[stage]):
+                    mismatches.append((dataset_name, stage, "present in only one of the two builds"))
+                elif os.path.isdir(current[stage]) and not _read_for_compare(current[stage]).equals(
+                        _read_for_compare(rebuilt[stage])):
+                    mismatches.append((dataset_name, stage, "contents differ from a full rebuild"))
+    return mismatches
+
+def verify(datasets=renaming_mappin.DATASETS, combined_dir=None, output_dir=None, full=False,
+           data_root=None):
+    """Check every stage output on disk against the manifest.
+
+    Each entry's fragments must exist, belong to no other entry and hold
+    exactly the entry's rows, and a stage directory must hold no other
+    fragments, so its row total equals the manifest's. Row counts are read
+    from the fragment footers. ``full`` also compares the contents with a
+    full rebuild (``compare_with_rebuild``). Returns a list of
+    ``(dataset, stage, problem)``.
+    """
+    combined_dir = combined_dir or combining.OUTPUT_DIR
+    output_dir = output_dir or renaming_mappin.OUTPUT_DIR
+    manifest = load_manifest(os.path.join(combined_dir, MANIFEST_NAME))
+    mismatches = []
+    for dataset_name in datasets:
+        entries = manifest['datasets'].get(dataset_name, {})
+        paths = stage_paths(dataset_name, combined_dir, output_dir)
+        for stage in BUILD_STAGES:
+            root = paths[stage]
+            owners = {}
+            for rel, entry in sorted(entries.items()):
+                fragments = entry['fragments'].get(stage, [])
+                missing = [fragment for fragment in fragments
+                           if not os.path.exists(os.path.join(root, fragment))]
+                if missing:
+                    mismatches.append((dataset_name, stage, f"{rel}: missing fragments {missing}"))
+                    continue
+                for fragment in fragments:
+                    if fragment in owners:
+                        mismatches.append((dataset_name, stage,
+                                           f"{rel} shares {fragment} with {owners[fragment]}"))
+                    owners.setdefault(fragment, rel)
+                rows = sum(_fragment_rows(root, fragment) for fragment in fragments)
+                if rows != entry['rows']:
+                    mismatches.append((dataset_name, stage,
+                                       f"{rel}: {rows} rows on disk, {entry['rows']} in the manifest"))
+
+            on_disk = sorted(os.path.relpath(path, root)
+                             for path in glob.glob(os.path.join(root, '**', '*.parquet'), recursive=True))
+            untracked = [fragment for fragment in on_disk if fragment not in owners]
+            if untracked:
+                mismatches.append((dataset_name, stage, f"fragments not in the manifest: {untracked}"))
+            rows = sum(_fragment_rows(root, fragment) for fragment in on_disk)
+            expected = sum(entry['rows'] for entry in entries.values())
+            if rows != expected:
+                mismatches.append((dataset_name, stage, f"{rows} rows on disk, {expected} in the manifest"))
+    if full:
+        mismatches += compare_with_rebuild(datasets, data_root, combined_dir, output_dir)
+    return mismatches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incrementally rebuild the dot1/dot2/dot3 outputs.")
+    parser.add_argument('--datasets', nargs='+', choices=renaming_mappin.DATASETS,
+                        default=list(renaming_mappin.DATASETS))
+    parser.add_argument('--force', action='store_true',
+                        help="Discard the manifest entries of the datasets and rebuild them")
+    parser.add_argument('--verify', action='store_true',
+                        help="After building, check the outputs against the manifest")
+    parser.add_argument('--full', action='store_true',
+                        help="With --verify, also compare the outputs with a full rebuild")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    build(args.datasets, force=args.force)
+    if args.verify:
+        mismatches = verify(args.datasets, full=args.full)
+        if mismatches:
+            for dataset_name, stage, problem in mismatches:
+                print(f"{dataset_name} {stage}: {problem}")
+            return 1
+        print("Incremental output matches the manifest.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import resource
+from collections import Counter
+from contextlib import contextmanager
+
+# Stage records and counters collected in this process. Worker processes
+# return their records to the parent, which adds them with add_records().
+_records = []
+_counters = Counter()
+
+PROMETHEUS_PREFIX = 'freight_pipeline'
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def path_size(path):
+    """Size in bytes of a file, or of every file under a directory."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+@contextmanager
+def stage(name, **labels):
+    """Time a pipeline stage and record it.
+
+    Yields the record dict so the caller can fill in ``rows_in``,
+    ``rows_out``, ``bytes_read`` and ``bytes_written``. Wall and CPU time and
+    the process peak RSS at the end of the stage are added automatically.
+    """
+    record = {'stage': name, **labels, 'rows_in': None, 'rows_out': None,
+              'bytes_read': None, 'bytes_written': None}
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall, 6)
+        record['cpu_s'] = round(time.process_time() - cpu, 6)
+        record['peak_rss_mb'] = peak_rss_mb()
+        _records.append(record)
+
+def count(name, n=1):
+    """Increment a named counter such as ``files_failed``."""
+    _counters[name] += n
+
+def add_records(records):
+    _records.extend(records)
+
+def take_records():
+    """Return and clear this process's records (used by worker processes)."""
+    records = list(_records)
+    _records.clear()
+    return records
+
+def reset():
+    _records.clear()
+    _counters.clear()
+
+def summarize(records):
+    """Aggregate records per stage: totals of time, rows and bytes."""
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record['stage'], {
+            'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': 0.0,
+            'rows_in': 0, 'rows_out': 0, 'bytes_read': 0, 'bytes_written': 0, 'errors': 0,
+        })
+        total['calls'] += 1
+        total['errors'] += 'error' in record
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+        for key in ('wall_s', 'cpu_s', 'rows_in', 'rows_out', 'bytes_read', 'bytes_written'):
+            total[key] += record.get(key) or 0
+    return totals
+
+def report():
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'peak_rss_mb': peak_rss_mb(),
+        'counters': dict(_counters),
+        'stages': summarize(_records),
+        'records': list(_records),
+    }
+
+def prometheus_text(data):
+    """Render a report in the Prometheus textfile-collector format.
+
+    Only per-stage totals and counters are exported; per-file records stay in
+    the JSON report to keep label cardinality low.
+    """
+    lines = []
+    fields = {
+        'wall_s': ('stage_wall_seconds', 'Wall-clock time spent in the stage'),
+        'cpu_s': ('stage_cpu_seconds', 'CPU time spent in the stage'),
+        'peak_rss_mb': ('stage_peak_rss_megabytes', 'Process peak RSS at the end of the stage'),
+        'rows_in': ('stage_rows_in', 'Rows entering the stage'),
+        'rows_out': ('stage_rows_out', 'Rows leaving the stage'),
+        'bytes_read': ('stage_bytes_read', 'Bytes read by the stage'),
+        'bytes_written': ('stage_bytes_written', 'Bytes written by the stage'),
+        'calls': ('stage_calls', 'Number of times the stage ran'),
+        'errors': ('stage_errors', 'Number of failed stage runs'),
+    }
+    for key, (metric, help_text) in fields.items():
+        name = f'{PROMETHEUS_PREFIX}_{metric}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for stage_name, total in sorted(data['stages'].items()):
+            lines.append(f'{name}{{stage="{stage_name}"}} {total[key]}')
+    for counter, value in sorted(data['counters'].items()):
+        name = f'{PROMETHEUS_PREFIX}_{counter}_total'
+        lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name} {value}')
+    name = f'{PROMETHEUS_PREFIX}_peak_rss_megabytes'
+    lines.append(f'# TYPE {name} gauge')
+    lines.append(f"{name} {data['peak_rss_mb']}")
+    return '\n'.join(lines) + '\n'
+
+def write_report(path, fmt='json'):
+    """Write the collected metrics as JSON or a Prometheus textfile (atomically)."""
+    data = report()
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        if fmt == 'prometheus':
+            f.write(prometheus_text(data))
+        elif fmt == 'json':
+            json.dump(data, f, indent=2)
+        else:
+            raise ValueError(f"Unknown metrics format {fmt!r}")
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,188 @@
+import io
+import os
+import shutil
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import metrics
+import schema
+import storage
+from codebooks import COLUMN_MAPPINGS, compiled_mapping
+from coverage import CoverageIndex
+from renaming_mappin import DATA_DIR, apply_mappings, enrich_data, resolve_dtypes
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the size of a CSV row partition; files are split into at
+# least one partition per worker
+PARTITION_BYTES = 64 * 1024 * 1024
+
+def csv_partitions(path, parts):
+    """Split a CSV into up to ``parts`` byte ranges ``(start, end)`` on line boundaries.
+
+    The header line is excluded. Assumes one record per line, as written by
+    combining.py; a range with an unbalanced quote is rejected when read.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        body = size - bounds[0]
+        for k in range(1, parts):
+            f.seek(bounds[0] + body * k // parts)
+            # Finish the current line so the range starts on a record
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    # A header-only file still yields one (empty) range so its outputs get a header
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _read_csv_range(path, start, end, columns, dtypes=None, na_values=None):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    if data.count(b'"') % 2:
+        raise ValueError(f"Quoted line break in {path} near byte {start}; "
+                         "this file cannot be split by lines, map it serially")
+    return pd.read_csv(io.BytesIO(data), header=None, names=columns, dtype=dtypes, na_values=na_values)
+
+def _partition_kinds(path, start, end, columns):
+    """Dtype kinds pandas infers for each column of one CSV range."""
+    df = _read_csv_range(path, start, end, columns)
+    return {col: {dtype.kind} for col, dtype in df.dtypes.items()}
+
+def _read_partition(source, dataset_name, typed):
+    if source['fmt'] == 'csv':
+        if not typed:
+            return _read_csv_range(source['path'], source['start'], source['end'], source['columns'],
+                                   source['dtypes'])
+        options = schema.csv_options(dataset_name)
+        df = _read_csv_range(source['path'], source['start'], source['end'], source['columns'],
+                             options['dtype'], options['na_values'])
+        return schema.coerce_numeric(df, dataset_name)
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(source['fragments'], schema=source['schema'], format='parquet',
+                         partitioning=ds.partitioning(flavor='hive'), partition_base_dir=source['path'])
+    df = dataset.to_table().to_pandas()
+    return schema.apply_schema(df, dataset_name) if typed else df
+
+def _map_partition(task):
+    """Read, map and write one row partition in a worker process.
+
+    CSV outputs are written to part files that the parent appends in order;
+    parquet outputs are written as fragments of the final dataset. Returns the
+    row count, the partition's coverage counts and the worker's metrics.
+    """
+    dataset_name, i, source, outputs, output_format, typed, coverage = task
+    with metrics.stage('map_partition', dataset=dataset_name, partition=i) as record:
+        df = _read_partition(source, dataset_name, typed)
+        record['rows_in'] = len(df)
+        index = CoverageIndex() if coverage else None
+        df_mapped = apply_mappings(df, dataset_name, index)
+        frames = {'cleaned': df_mapped}
+        if 'enriched' in outputs:
+            frames['enriched'] = enrich_data(df, df_mapped, dataset_name)
+        for stage, path in outputs.items():
+            with metrics.stage('write', dataset=dataset_name, output=stage, partition=i) as write:
+                write['rows_in'] = write['rows_out'] = len(frames[stage])
+                if output_format == 'csv':
+                    frames[stage].to_csv(path, header=i == 0, index=False)
+                else:
+                    storage.write_dataset(frames[stage], path, 'parquet', append=True,
+                                          basename=f'part{i:05d}')
+                write['bytes_written'] = metrics.path_size(path) if output_format == 'csv' else None
+        record['rows_out'] = len(df)
+    return len(df), index.counts if index is not None else None, metrics.take_records()
+
+def plan_partitions(dataset_name, data_dir, workers, typed, pool):
+    """Describe the row partitions of a combined dataset, in row order.
+
+    Parquet datasets are split by fragment (one YEAR/MONTH file each). CSV
+    files are split into byte ranges; unless ``typed``, their dtypes are
+    first inferred per range on ``pool`` and resolved as a whole-file read
+    would, so every partition parses with the same types.
+    """
+    parquet_path = storage.dataset_path(data_dir, f'{dataset_name}_all', 'parquet')
+    if os.path.isdir(parquet_path):
+        dataset = storage.open_parquet_dataset(parquet_path)
+        return [{'fmt': 'parquet', 'path': parquet_path, 'schema': dataset.schema, 'fragments': [fragment.path]}
+                for fragment in dataset.get_fragments()]
+
+    path = storage.dataset_path(data_dir, f'{dataset_name}_all', 'csv')
+    parts = max(workers, -(-os.path.getsize(path) // PARTITION_BYTES))
+    columns = pd.read_csv(path, nrows=0).columns.tolist()
+    ranges = csv_partitions(path, parts)
+    dtypes = None
+    if not typed:
+        kinds = {col: set() for col in columns}
+        for result in pool.map(_partition_kinds, *zip(*[(path, start, end, columns) for start, end in ranges])):
+            for col, col_kinds in result.items():
+                kinds[col] |= col_kinds
+        dtypes = resolve_dtypes(kinds)
+    return [{'fmt': 'csv', 'path': path, 'start': start, 'end': end, 'columns': columns, 'dtypes': dtypes}
+            for start, end in ranges]
+
+def _append_part(part_path, out):
+    with open(part_path, 'rb') as part:
+        shutil.copyfileobj(part, out, 1 << 20)
+    os.remove(part_path)
+
+def map_datasets_parallel(output_paths, output_format='csv', workers=None, data_dir=None,
+                          typed=False, coverage=None):
+    """Map every dataset's row partitions on one process pool.
+
+    ``output_paths`` is ``{dataset: {stage: path}}`` as built by
+    ``run_pipeline``. Partitions of all datasets share the pool, so small
+    datasets do not leave cores idle. Workers write their outputs
+    themselves; for CSV the parent only appends the finished part files in
+    row order, so the result is byte-identical to the serial path. Returns
+    the number of rows mapped per dataset.
+    """
+    workers = workers or os.cpu_count() or 1
+    data_dir = data_dir or DATA_DIR
+    # Compile the lookup tables before forking so workers share them read-only
+    for mapping_name in COLUMN_MAPPINGS.values():
+        compiled_mapping(mapping_name)
+
+    # Part files go next to the outputs so appending them stays on one filesystem
+    output_dir = os.path.dirname(next(path for paths in output_paths.values() for path in paths.values()))
+
+    rows = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool, tempfile.TemporaryDirectory(dir=output_dir) as tmp:
+        tasks = {}
+        for dataset_name, paths in output_paths.items():
+            for path in paths.values():
+                if output_format == 'parquet' and os.path.isdir(path):
+                    shutil.rmtree(path)
+                storage.remove_other_formats(path, output_format)
+            with metrics.stage('plan', dataset=dataset_name) as record:
+                sources = plan_partitions(dataset_name, data_dir, workers, typed, pool)
+                record['rows_out'] = len(sources)
+            tasks[dataset_name] = []
+            for i, source in enumerate(sources):
+                outputs = paths if output_format == 'parquet' else {
+                    stage: os.path.join(tmp, f'{dataset_name}-{stage}-{i:05d}.csv') for stage in paths}
+                task = (dataset_name, i, source, outputs, output_format, typed, coverage is not None)
+                tasks[dataset_name].append((outputs, pool.submit(_map_partition, task)))
+
+        for dataset_name, futures in tasks.items():
+            outs = {}
+            if output_format == 'csv':
+                outs = {stage: open(path, 'wb') for stage, path in output_paths[dataset_name].items()}
+            try:
+                rows[dataset_name] = 0
+                for outputs, future in futures:
+                    n, counts, records = future.result()
+                    metrics.add_records(records)
+                    if coverage is not None:
+                        coverage.merge(CoverageIndex(counts))
+                    for stage, out in outs.items():
+                        _append_part(outputs[stage], out)
+                    rows[dataset_name] += n
+            finally:
+                for out in outs.values():
+                    out.close()
+            logger.info(f"Mapped {rows[dataset_name]} rows of {dataset_name} in {len(futures)} partitions")
+    return rows
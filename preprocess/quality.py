@@ -0,0 +1,310 @@
+import os
+import json
+import shutil
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+import combining
+import metrics
+import sketches
+import storage
+from codebooks import COLUMN_MAPPINGS, NULL_REPRESENTATIONS, compiled_mapping
+from renaming_mappin import DATASETS
+from schema import DATASET_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+REPORT_NAME = 'quality_report.json'
+
+# Measures are not part of a record's identity: a re-released month carries the
+# same dimension codes, possibly with revised values
+MEASURE_COLUMNS = ('VALUE', 'SHIPWT', 'FREIGHT_CHARGES')
+
+# Columns identifying a record in each dataset (everything but the measures
+# and the SOURCE_FILE tag, which differs between re-releases by design and
+# decides which release's copy is kept)
+BUSINESS_KEYS = {
+    dataset_name: [col for col in columns if col not in MEASURE_COLUMNS and col != 'SOURCE_FILE']
+    for dataset_name, columns in DATASET_COLUMNS.items()
+}
+
+def row_fingerprints(df, columns):
+    """64-bit hash of each row's ``columns``, computed column-wise by pandas."""
+    present = [col for col in columns if col in df.columns]
+    missing = [col for col in columns if col not in df.columns]
+    key = df[present].reindex(columns=present + missing)
+    return pd.util.hash_pandas_object(key, index=False).to_numpy()
+
+class FingerprintSet:
+    """Sorted array of the fingerprints seen so far.
+
+    Takes 8 bytes per distinct row instead of a Python object per row, and
+    membership tests are a vectorized binary search.
+    """
+
+    def __init__(self):
+        self._seen = np.empty(0, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self._seen)
+
+    def add(self, hashes):
+        """Record ``hashes`` and return a mask of the rows seen for the first time."""
+        first = ~pd.Series(hashes).duplicated().to_numpy()
+        if len(self._seen):
+            position = np.searchsorted(self._seen, hashes)
+            found = self._seen[np.minimum(position, len(self._seen) - 1)] == hashes
+            first &= ~found
+        self._seen = np.union1d(self._seen, hashes[first])
+        return first
+
+class ReleaseWinners:
+    """The release whose copy of each record is kept.
+
+    Filled by a first pass over the chunks (``add``). For every business-key
+    fingerprint the row from the greatest SOURCE_FILE wins. SOURCE_FILE is
+    the source path relative to the data root, so a revision in a later
+    sorting path (a ``rerelease/`` folder, a later dated folder) supersedes
+    the original whatever order the rows are stored in. Holds 12 bytes per
+    distinct record.
+    """
+
+    def __init__(self):
+        self.sources = {}
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._codes = np.empty(0, dtype=np.int32)
+
+    def codes(self, df):
+        """Code of each row's SOURCE_FILE, registering new paths."""
+        if 'SOURCE_FILE' in df.columns:
+            names = df['SOURCE_FILE'].astype(object).where(df['SOURCE_FILE'].notna(), '').astype(str)
+        else:
+            names = pd.Series('', index=df.index)
+        for name in names.unique():
+            self.sources.setdefault(name, len(self.sources))
+        return names.map(self.sources).to_numpy(dtype=np.int32)
+
+    def add(self, hashes, codes):
+        hashes = np.concatenate([self._hashes, hashes])
+        codes = np.concatenate([self._codes, codes])
+        ranks = np.empty(len(self.sources), dtype=np.int64)
+        for rank, name in enumerate(sorted(self.sources)):
+            ranks[self.sources[name]] = rank
+        # Each fingerprint's rows sorted by descending source path; the first wins
+        order = np.lexsort((-ranks[codes], hashes))
+        hashes, codes = hashes[order], codes[order]
+        first = np.ones(len(hashes), dtype=bool)
+        first[1:] = hashes[1:] != hashes[:-1]
+        self._hashes, self._codes = hashes[first], codes[first]
+
+    def winners(self, hashes):
+        """Winning source code of each (already added) fingerprint."""
+        return self._codes[np.searchsorted(self._hashes, hashes)]
+
+def find_winners(chunks, dataset_name):
+    """First pass of ``deduplicate_chunks``: the winning release of every record."""
+    winners = ReleaseWinners()
+    key = BUSINESS_KEYS[dataset_name]
+    for chunk in chunks:
+        with metrics.stage('dedup_scan', dataset=dataset_name) as record:
+            record['rows_in'] = len(chunk)
+            winners.add(row_fingerprints(chunk, key), winners.codes(chunk))
+    return winners
+
+class QualityReport:
+    """Row, duplicate, null and unknown-code counts for one dataset.
+
+    ``update`` takes one chunk at a time. Null and unknown-code rates are
+    counted on the kept rows of every ``COLUMN_MAPPINGS`` column present; a
+    code is unknown when it is neither a null spelling nor in its codebook.
+    """
+
+    def __init__(self, dataset_name):
+        self.dataset_name = dataset_name
+        self.rows_in = 0
+        self.rows_out = 0
+        self.duplicates_by_file = {}
+        self.columns = {}
+
+    def update(self, df, kept):
+        self.rows_in += len(df)
+        self.rows_out += int(kept.sum())
+        if 'SOURCE_FILE' in df.columns and not kept.all():
+            dropped = df.loc[~kept, 'SOURCE_FILE'].fillna('').value_counts()
+            for name, n in dropped.items():
+                self.duplicates_by_file[name] = self.duplicates_by_file.get(name, 0) + int(n)
+
+        df = df[kept]
+        for col, mapping_name in COLUMN_MAPPINGS.items():
+            if col not in df.columns:
+                continue
+            lookup, _ = compiled_mapping(mapping_name)
+            # Count the distinct values once instead of testing every row
+            codes, uniques = pd.factorize(df[col])
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            nulls = int((codes < 0).sum())
+            unknown = 0
+            for value, n in zip(uniques, counts):
+                value = str(value)
+                if value in NULL_REPRESENTATIONS:
+                    nulls += int(n)
+                elif value not in lookup:
+                    unknown += int(n)
+            total = self.columns.setdefault(col, {'rows': 0, 'nulls': 0, 'unknown_codes': 0})
+            total['rows'] += len(df)
+            total['nulls'] += nulls
+            total['unknown_codes'] += unknown
+
+    def to_dict(self):
+        columns = {}
+        for col, total in self.columns.items():
+            rows = total['rows']
+            columns[col] = {
+                **total,
+                'null_rate': round(total['nulls'] / rows, 6) if rows else None,
+                'unknown_rate': round(total['unknown_codes'] / rows, 6) if rows else None,
+            }
+        return {
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'duplicates': self.rows_in - self.rows_out,
+            'duplicates_by_file': dict(sorted(self.duplicates_by_file.items())),
+            'columns': columns,
+        }
+
+def deduplicate_chunks(chunks, dataset_name, winners, report=None):
+    """Yield each chunk without the duplicate rows of a record.
+
+    Only rows from the record's winning release (see ``ReleaseWinners``,
+    built by ``find_winners`` over the same chunks) are candidates, and of
+    those the first is kept, so the result does not depend on storage order.
+    """
+    seen = FingerprintSet()
+    key = BUSINESS_KEYS[dataset_name]
+    for chunk in chunks:
+        with metrics.stage('dedup', dataset=dataset_name) as record:
+            record['rows_in'] = len(chunk)
+            hashes = row_fingerprints(chunk, key)
+            kept = winners.winners(hashes) == winners.codes(chunk)
+            kept[kept] = seen.add(hashes[kept])
+            if report is not None:
+                report.update(chunk, kept)
+            chunk = chunk[kept]
+            record['rows_out'] = len(chunk)
+        yield chunk
+
+def read_chunks(path, chunksize, fmt=None):
+    """Stream a combined artifact as string frames of at most ``chunksize`` rows."""
+    fmt = fmt or storage.detect_format(path)
+    if fmt == 'csv':
+        # Raw strings throughout, so a value hashes the same whatever the chunk's
+        # inferred type and spellings like 'NA' are written back unchanged
+        yield from pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize)
+        return
+    for batch in storage.open_parquet_dataset(path).to_batches(batch_size=chunksize):
+        yield batch.to_pandas().astype('string')
+
+def deduplicate(input_path, output_path, dataset_name, chunksize=1_000_000, fmt=None, sketch_index=None):
+    """Write ``input_path`` to ``output_path`` without duplicate records.
+
+    Rows are streamed in chunks, twice: once to find each record's winning
+    release, then to write it. Only fingerprints and winners are held in
+    memory. The kept rows are added to ``sketch_index`` if given. Returns the
+    dataset's ``QualityReport``.
+    """
+    fmt = fmt or storage.detect_format(input_path)
+    report = QualityReport(dataset_name)
+    metrics.count('bytes_read', metrics.path_size(input_path))
+
+    winners = find_winners(read_chunks(input_path, chunksize, fmt), dataset_name)
+    chunks = deduplicate_chunks(read_chunks(input_path, chunksize, fmt), dataset_name, winners, report)
+    written = False
+    for i, chunk in enumerate(chunks):
+        if fmt == 'parquet' and chunk.empty:
+            continue
+        if sketch_index is not None:
+            sketch_index.observe(dataset_name, chunk)
+        storage.write_dataset(chunk, output_path, fmt, append=written,
+                              basename=f'dedup{i:05d}' if fmt == 'parquet' else None)
+        written = True
+    if not written:
+        # Keep the header of an empty (or fully duplicated) input
+        storage.write_dataset(pd.DataFrame(columns=storage.read_columns(input_path, fmt)),
+                              output_path, fmt)
+    metrics.count('duplicates_dropped', report.rows_in - report.rows_out)
+    logger.info(f"{dataset_name}: kept {report.rows_out} of {report.rows_in} rows")
+    return report
+
+def deduplicate_in_place(path, dataset_name, chunksize=1_000_000, sketch_index=None):
+    """Deduplicate a combined artifact, replacing it only once the copy is complete."""
+    fmt = storage.detect_format(path)
+    tmp_path = f'{path}.dedup.tmp'
+    if fmt == 'parquet' and os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    report = deduplicate(path, tmp_path, dataset_name, chunksize, fmt, sketch_index)
+    if fmt == 'parquet':
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return report
+
+def write_report(reports, path):
+    """Write ``{dataset: report}`` as JSON (atomically)."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({name: report.to_dict() for name, report in reports.items()}, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Drop duplicate records from the combined datasets and report data quality.")
+    parser.add_argument('--datasets', nargs='+', choices=DATASETS, default=list(DATASETS))
+    parser.add_argument('--data-dir', default=combining.OUTPUT_DIR,
+                        help="Directory holding the combined <dataset>_all artifacts")
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--report', default=None,
+                        help=f"Quality report path (default: <data-dir>/{REPORT_NAME})")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Only compute the report; leave the combined datasets untouched")
+    parser.add_argument('--metrics', default=None,
+                        help="Write per-stage timing/row/byte metrics to this path")
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    reports = {}
+    # The ingest-time sketches counted duplicates too; they are rebuilt from
+    # the rows kept
+    sketch_index = sketches.SketchIndex()
+    for dataset_name in DATASETS:
+        if dataset_name not in args.datasets:
+            continue
+        for fmt in ('parquet', 'csv'):
+            path = storage.dataset_path(args.data_dir, f'{dataset_name}_all', fmt)
+            if os.path.exists(path):
+                break
+        else:
+            logger.warning(f"No combined {dataset_name} dataset in {args.data_dir}")
+            continue
+        if args.dry_run:
+            report = QualityReport(dataset_name)
+            winners = find_winners(read_chunks(path, args.chunksize, fmt), dataset_name)
+            for _ in deduplicate_chunks(read_chunks(path, args.chunksize, fmt), dataset_name, winners, report):
+                pass
+            reports[dataset_name] = report
+        else:
+            sketch_index.sketches[dataset_name] = {}
+            reports[dataset_name] = deduplicate_in_place(path, dataset_name, args.chunksize, sketch_index)
+        summary = reports[dataset_name].to_dict()
+        print(f"{dataset_name}: dropped {summary['duplicates']} duplicates of {summary['rows_in']} rows")
+
+    if not args.dry_run:
+        sketches.save_index(sketch_index, args.data_dir)
+    report_path = write_report(reports, args.report or os.path.join(args.data_dir, REPORT_NAME))
+    print(f"Wrote {report_path}")
+    if args.metrics:
+        metrics.write_report(args.metrics, args.metrics_format)
+
+if __name__ == "__main__":
+    main()
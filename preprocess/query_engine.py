@@ -0,0 +1,152 @@
+import os
+import argparse
+import pandas as pd
+import renaming_mappin
+import storage
+from codebooks import MAPPINGS
+
+# Measures that canned queries may aggregate (interpolated into SQL, so they
+# are whitelisted rather than passed as parameters)
+MEASURES = ('Weight', 'Trade_Value', 'Freight_Charges')
+
+def require_duckdb():
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("The SQL query engine requires duckdb: pip install duckdb") from e
+    return duckdb
+
+def _source_sql(path):
+    """DuckDB table function scanning a cleaned artifact without loading it."""
+    if storage.detect_format(path) == 'parquet':
+        pattern = os.path.join(path, '**', '*.parquet').replace("'", "''")
+        return f"read_parquet('{pattern}', hive_partitioning = true, union_by_name = true)"
+    path = path.replace("'", "''")
+    return f"read_csv_auto('{path}', header = true)"
+
+def connect(output_dir=None, database=':memory:'):
+    """Open an in-process DuckDB connection over the pipeline outputs.
+
+    Registers a view per available cleaned dataset (``dot1``, ``dot2``,
+    ``dot3``) and one ``<mapping>_lookup(code, label)`` table per entry of
+    ``MAPPINGS``. Views scan the files lazily, so nothing is loaded until a
+    query runs.
+    """
+    duckdb = require_duckdb()
+    output_dir = output_dir or renaming_mappin.OUTPUT_DIR
+    con = duckdb.connect(database)
+
+    for dataset_name in renaming_mappin.DATASETS:
+        path = storage.find_dataset(output_dir, f'{dataset_name}_all_cleaned')
+        if path is not None:
+            con.execute(f"CREATE OR REPLACE VIEW {dataset_name} AS SELECT * FROM {_source_sql(path)}")
+
+    for mapping_name, mapping in MAPPINGS.items():
+        table = f'{mapping_name}_lookup'
+        con.execute(f"CREATE OR REPLACE TABLE {table} (code VARCHAR, label VARCHAR)")
+        con.executemany(f"INSERT INTO {table} VALUES (?, ?)", [(str(k), v) for k, v in mapping.items()])
+    return con
+
+# Canned queries for the notebook's insights. Parameters use DuckDB's $name
+# syntax; {measure} is filled from the MEASURES whitelist.
+QUERIES = {
+    # Top-N U.S. states by shipment records, with the mode breakdown
+    'top_states': """
+        WITH filtered AS (
+            SELECT * FROM dot1
+            WHERE TRY_CAST(Year AS INTEGER) BETWEEN $year_from AND $year_to
+        ), top AS (
+            SELECT US_State, count(*) AS records
+            FROM filtered GROUP BY US_State ORDER BY records DESC LIMIT $n
+        )
+        SELECT f.US_State, f.Mode_of_Transport, count(*) AS records
+        FROM filtered f JOIN top USING (US_State)
+        GROUP BY f.US_State, f.Mode_of_Transport, top.records
+        ORDER BY top.records DESC, records DESC
+    """,
+    # Mode-route pairs with the highest average freight cost per unit weight
+    'inefficient_routes': """
+        SELECT Mode_of_Transport,
+               concat_ws('-', US_State, Mexico_State, Canada_Province) AS Route,
+               avg(TRY_CAST(Freight_Charges AS DOUBLE) / NULLIF(TRY_CAST(Weight AS DOUBLE), 0))
+                   AS Cost_per_Weight,
+               count(*) AS records
+        FROM dot2
+        WHERE TRY_CAST(Year AS INTEGER) BETWEEN $year_from AND $year_to
+        GROUP BY ALL
+        HAVING Cost_per_Weight IS NOT NULL
+        ORDER BY Cost_per_Weight DESC
+        LIMIT $n
+    """,
+    # Busiest ports by weight with their value and average cost per weight
+    'port_bottlenecks': """
+        SELECT Port_District,
+               sum(TRY_CAST(Weight AS DOUBLE)) AS Weight,
+               sum(TRY_CAST(Trade_Value AS DOUBLE)) AS Trade_Value,
+               avg(TRY_CAST(Freight_Charges AS DOUBLE) / NULLIF(TRY_CAST(Weight AS DOUBLE), 0))
+                   AS Cost_per_Weight
+        FROM dot1
+        WHERE TRY_CAST(Year AS INTEGER) BETWEEN $year_from AND $year_to
+        GROUP BY Port_District
+        ORDER BY Weight DESC NULLS LAST
+        LIMIT $n
+    """,
+    # Monthly totals of a measure per mode, in chronological order
+    'seasonal_by_mode': """
+        SELECT TRY_CAST(d.Year AS INTEGER) AS Year,
+               TRY_CAST(m.code AS INTEGER) AS Month,
+               d.Mode_of_Transport,
+               sum(TRY_CAST(d.{measure} AS DOUBLE)) AS {measure}
+        FROM {dataset} d
+        JOIN month_map_lookup m ON CAST(d.Month AS VARCHAR) = m.label
+        WHERE TRY_CAST(d.Year AS INTEGER) BETWEEN $year_from AND $year_to
+        GROUP BY ALL
+        ORDER BY Year, Month, d.Mode_of_Transport
+    """,
+}
+
+DEFAULT_PARAMS = {'n': 10, 'year_from': 0, 'year_to': 9999}
+
+def execute(con, name, measure='Weight', dataset='dot1', **params):
+    """Run a canned query and return the open DuckDB result."""
+    if name not in QUERIES:
+        raise KeyError(f"Unknown query {name!r}, expected one of {sorted(QUERIES)}")
+    if measure not in MEASURES:
+        raise ValueError(f"Unknown measure {measure!r}, expected one of {MEASURES}")
+    if dataset not in renaming_mappin.DATASETS:
+        raise ValueError(f"Unknown dataset {dataset!r}")
+    sql = QUERIES[name].format(measure=measure, dataset=dataset)
+    # Only bind the parameters the query actually uses
+    values = {**DEFAULT_PARAMS, **params}
+    values = {key: value for key, value in values.items() if f'${key}' in sql}
+    return con.execute(sql, values)
+
+def stream(con, name, batch_size=100_000, **kwargs):
+    """Yield a canned query's result as DataFrames of at most ``batch_size`` rows."""
+    result = execute(con, name, **kwargs)
+    columns = [col[0] for col in result.description]
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        yield pd.DataFrame(rows, columns=columns)
+
+def query(con, name, **kwargs):
+    """Run a canned query and return the whole (aggregated) result as a DataFrame."""
+    return execute(con, name, **kwargs).df()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a canned SQL query over the cleaned datasets.")
+    parser.add_argument('query', choices=sorted(QUERIES))
+    parser.add_argument('--output-dir', default=renaming_mappin.OUTPUT_DIR)
+    parser.add_argument('--n', type=int, default=DEFAULT_PARAMS['n'])
+    parser.add_argument('--year-from', type=int, default=DEFAULT_PARAMS['year_from'])
+    parser.add_argument('--year-to', type=int, default=DEFAULT_PARAMS['year_to'])
+    parser.add_argument('--measure', choices=MEASURES, default='Weight')
+    parser.add_argument('--dataset', choices=renaming_mappin.DATASETS, default='dot1')
+    args = parser.parse_args()
+
+    con = connect(args.output_dir)
+    for frame in stream(con, args.query, measure=args.measure, dataset=args.dataset,
+                        n=args.n, year_from=args.year_from, year_to=args.year_to):
+        print(frame.to_string(index=False))
@@ -0,0 +1,181 @@
+import sys
+import logging
+import numpy as np
+import pandas as pd
+import metrics
+from codebooks import NULL_REPRESENTATIONS
+
+logger = logging.getLogger(__name__)
+
+# Compact column types for the combined (raw code) datasets. Every code is
+# categorical so it keeps its exact spelling (DEPE '0901', CONTCODE 'X') and
+# unknown codes such as 'ZZ99' load like any other; YEAR and the measures are
+# numeric.
+CODE = 'category'
+RAW_TYPES = {
+    'TRDTYPE': CODE,
+    'USASTATE': CODE,
+    'DEPE': CODE,
+    'DISAGMOT': CODE,
+    'MEXSTATE': CODE,
+    'CANPROV': CODE,
+    'COUNTRY': CODE,
+    'COMMODITY2': CODE,
+    'VALUE': 'float64',
+    'SHIPWT': 'float64',
+    'FREIGHT_CHARGES': 'float64',
+    'DF': CODE,
+    'CONTCODE': CODE,
+    'MONTH': CODE,
+    'YEAR': 'Int16',
+    'SOURCE_FILE': CODE,
+}
+
+# Month labels in calendar order, as produced by month_map
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+MONTH_TYPE = pd.CategoricalDtype(MONTHS + ['Unknown'], ordered=True)
+
+# Compact column types for the cleaned (mapped label) datasets
+CLEANED_TYPES = {
+    'Trade_Type': CODE,
+    'US_State': CODE,
+    'Port_District': CODE,
+    'Mode_of_Transport': CODE,
+    'Mexico_State': CODE,
+    'Canada_Province': CODE,
+    'Country': CODE,
+    'Commodity_Code': CODE,
+    'Trade_Value': 'float64',
+    'Weight': 'float64',
+    'Freight_Charges': 'float64',
+    'Direction_Flag': CODE,
+    'Container_Code': CODE,
+    'Month': MONTH_TYPE,
+    'Year': 'Int16',
+    'Source_File': CODE,
+    # Derived by derive.derive_measures
+    'Cost_per_Weight': 'float64',
+    'Value_per_Weight': 'float64',
+    'Freight_Share': 'float64',
+}
+
+# Columns present in each dataset (raw names)
+DATASET_COLUMNS = {
+    'dot1': ['TRDTYPE', 'USASTATE', 'DEPE', 'DISAGMOT', 'MEXSTATE', 'CANPROV', 'COUNTRY',
+             'VALUE', 'SHIPWT', 'FREIGHT_CHARGES', 'DF', 'CONTCODE', 'MONTH', 'YEAR', 'SOURCE_FILE'],
+    'dot2': ['TRDTYPE', 'USASTATE', 'DEPE', 'DISAGMOT', 'MEXSTATE', 'CANPROV', 'COUNTRY',
+             'VALUE', 'SHIPWT', 'FREIGHT_CHARGES', 'DF', 'CONTCODE', 'MONTH', 'YEAR',
+             'SOURCE_FILE', 'COMMODITY2'],
+    'dot3': ['TRDTYPE', 'DEPE', 'COMMODITY2', 'DISAGMOT', 'COUNTRY', 'VALUE', 'SHIPWT',
+             'FREIGHT_CHARGES', 'DF', 'CONTCODE', 'MONTH', 'YEAR', 'SOURCE_FILE'],
+}
+
+STAGE_TYPES = {'raw': RAW_TYPES, 'cleaned': CLEANED_TYPES}
+
+def schema_for(dataset_name, stage='raw'):
+    """Return ``{column: dtype}`` for a dataset at the 'raw' or 'cleaned' stage."""
+    if stage not in STAGE_TYPES:
+        raise ValueError(f"Unknown stage {stage!r}, expected one of {sorted(STAGE_TYPES)}")
+    if stage == 'raw':
+        return {col: RAW_TYPES[col] for col in DATASET_COLUMNS[dataset_name]}
+    # Imported lazily to keep this module free of the mapping tables
+    from renaming_mappin import COLUMN_RENAMES
+    from derive import DERIVED
+    renames = COLUMN_RENAMES[dataset_name]
+    types = {renames[col]: CLEANED_TYPES[renames[col]] for col in DATASET_COLUMNS[dataset_name]}
+    for name, operands in DERIVED.items():
+        if set(operands) <= set(types):
+            types[name] = CLEANED_TYPES[name]
+    return types
+
+def _is_numeric(dtype):
+    return dtype != CODE and not isinstance(dtype, pd.CategoricalDtype)
+
+def csv_options(dataset_name, stage='raw'):
+    """``pd.read_csv`` keyword arguments for parsing with the compact schema.
+
+    Null spellings are read as missing. Numeric columns are read as strings
+    and converted afterwards by ``coerce_numeric``, so one stray value cannot
+    abort the parse.
+    """
+    types = schema_for(dataset_name, stage)
+    return {
+        'dtype': {col: 'string' if _is_numeric(dtype) else dtype for col, dtype in types.items()},
+        'na_values': list(NULL_REPRESENTATIONS),
+    }
+
+def coerce_numeric(df, dataset_name, stage='raw'):
+    """Convert the numeric columns of a frame to their schema types.
+
+    Values that are not numbers (or do not fit an integer type) become
+    missing and are counted in the ``rejected_<column>`` counters.
+    """
+    rejected = {}
+    for col, dtype in schema_for(dataset_name, stage).items():
+        if col not in df.columns or not _is_numeric(dtype) or df[col].dtype == dtype:
+            continue
+        values = pd.to_numeric(df[col], errors='coerce')
+        if pd.api.types.is_integer_dtype(dtype):
+            limits = np.iinfo(pd.api.types.pandas_dtype(dtype).numpy_dtype)
+            values = values.where((values == values.round()) & values.between(limits.min, limits.max))
+        count = int((values.isna() & df[col].notna()).sum())
+        if count:
+            rejected[col] = count
+            metrics.count(f'rejected_{col}', count)
+        df[col] = values.astype(dtype)
+    if rejected:
+        logger.warning(f"{dataset_name} ({stage}): rejected values that do not fit the schema {rejected}")
+    return df
+
+def read_csv_typed(path, dataset_name, stage='raw', report=True, **kwargs):
+    """``pd.read_csv`` with the dataset's compact schema applied at parse time."""
+    df = pd.read_csv(path, **csv_options(dataset_name, stage), **kwargs)
+    if isinstance(df, pd.io.parsers.TextFileReader):
+        return (coerce_numeric(chunk, dataset_name, stage) for chunk in df)
+    df = coerce_numeric(df, dataset_name, stage)
+    if report:
+        log_memory_report(df, f'{dataset_name} ({stage})')
+    return df
+
+def apply_schema(df, dataset_name, stage='raw'):
+    """Cast an already loaded frame to the compact schema (present columns only)."""
+    types = schema_for(dataset_name, stage)
+    df = df.astype({col: dtype for col, dtype in types.items() if col in df.columns and not _is_numeric(dtype)})
+    return coerce_numeric(df, dataset_name, stage)
+
+def string_memory_estimate(df, sample_size=100_000):
+    """Estimate the bytes ``df`` would take with every column held as Python strings.
+
+    Measured on a sample of rows (as ``dtype=str`` loading would store them)
+    and scaled to the full frame.
+    """
+    if df.empty:
+        return 0
+    sample = df.sample(min(len(df), sample_size), random_state=0) if len(df) > sample_size else df
+    per_row = 0
+    for col in sample.columns:
+        values = sample[col].astype(object)
+        # One pointer per cell plus the string object it points to
+        per_row += sum(8 + sys.getsizeof(str(v)) for v in values) / len(values)
+    return int(per_row * len(df))
+
+def memory_report(df, sample_size=100_000):
+    """Typed in-memory size against the estimated all-strings size."""
+    typed = int(df.memory_usage(deep=True).sum())
+    strings = string_memory_estimate(df, sample_size)
+    return {
+        'rows': len(df),
+        'typed_bytes': typed,
+        'string_bytes_estimate': strings,
+        'reduction': round(strings / typed, 1) if typed else None,
+    }
+
+def log_memory_report(df, label):
+    report = memory_report(df)
+    logger.info(
+        f"{label}: {report['typed_bytes'] / 1e6:.1f} MB typed vs "
+        f"~{report['string_bytes_estimate'] / 1e6:.1f} MB as strings "
+        f"({report['reduction']}x smaller)"
+    )
+    return report
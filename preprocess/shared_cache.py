@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import argparse
+import pandas as pd
+import metrics
+import renaming_mappin
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Published builds live under SHARED_DIR/builds/<build id>/ and
+# SHARED_DIR/current.json names the build readers should open
+SHARED_NAME = 'shared'
+SHARED_DIR = os.path.join(renaming_mappin.OUTPUT_DIR, SHARED_NAME)
+MANIFEST_NAME = 'current.json'
+MANIFEST_VERSION = 1
+
+# Builds kept on disk (the current one included); older builds are removed
+# after a publish. Readers still mapping a removed build keep their pages.
+KEEP_BUILDS = 3
+
+def manifest_path(directory=None):
+    return os.path.join(directory or SHARED_DIR, MANIFEST_NAME)
+
+def load_manifest(directory=None):
+    """The current build's manifest, or None if nothing was published."""
+    path = manifest_path(directory)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported shared cache version in {path}; republish it")
+    return manifest
+
+def _record_batches(path, chunksize):
+    """Stream an output as Arrow record batches with one schema throughout."""
+    pa = storage.require_pyarrow()
+    if storage.detect_format(path) == 'parquet':
+        dataset = storage.open_parquet_dataset(path)
+        # Hive partition columns come back dictionary encoded per fragment; an
+        # IPC file needs one dictionary per column, so store their plain values
+        schema = pa.schema([field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type)
+                            else field for field in dataset.schema])
+        for batch in dataset.to_batches(batch_size=chunksize):
+            # Empty fragments give zero-row batches, which combine to no batch at all
+            yield from pa.Table.from_batches([batch]).cast(schema).combine_chunks().to_batches()
+        return
+    # Chunk dtypes are resolved first so every batch matches a whole-file read_csv
+    dtypes = renaming_mappin.infer_csv_dtypes(path, chunksize)
+    schema = None
+    for chunk in pd.read_csv(path, dtype=dtypes, chunksize=chunksize):
+        table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+        schema = table.schema
+        yield from table.to_batches()
+
+def write_arrow(source_path, path, chunksize=1_000_000):
+    """Convert an output to an uncompressed Arrow IPC file; returns its row count.
+
+    Buffers are left uncompressed so readers can map them without decoding.
+    """
+    pa = storage.require_pyarrow()
+    import pyarrow.ipc
+
+    rows = 0
+    writer = None
+    try:
+        for batch in _record_batches(source_path, chunksize):
+            if writer is None:
+                writer = pa.ipc.new_file(path, batch.schema)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        # An output without rows still gets a file with its columns
+        columns = storage.read_columns(source_path)
+        with pa.ipc.new_file(path, pa.schema([(col, pa.string()) for col in columns])):
+            pass
+    return rows
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def publish(output_paths, directory=None, chunksize=1_000_000):
+    """Publish pipeline outputs as a new build of the shared cache.
+
+    ``output_paths`` is ``{dataset: {stage: path}}`` as returned by
+    ``renaming_mappin.run_pipeline``. Each output is converted to an Arrow
+    IPC file in a fresh build directory; outputs whose source is unchanged
+    since the current build, and datasets not being published, are
+    hard-linked from it. The build is renamed into place and then made
+    current by atomically replacing the manifest, so a reader sees either
+    the old build or the new one, never a partial one. Returns the manifest.
+    """
+    directory = directory or SHARED_DIR
+    builds_dir = os.path.join(directory, 'builds')
+    os.makedirs(builds_dir, exist_ok=True)
+    previous = load_manifest(directory) or {'build': None, 'datasets': {}}
+
+    build = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = os.path.join(builds_dir, f'{build}.tmp')
+    os.makedirs(tmp_dir)
+    datasets = {}
+    try:
+        # Outputs not being republished carry over from the current build
+        for dataset_name, entries in previous['datasets'].items():
+            for stage, entry in entries.items():
+                if stage not in output_paths.get(dataset_name, {}):
+                    name = os.path.basename(entry['file'])
+                    _link_or_copy(os.path.join(directory, entry['file']), os.path.join(tmp_dir, name))
+                    datasets.setdefault(dataset_name, {})[stage] = {
+                        **entry, 'file': os.path.join('builds', build, name)}
+
+        for dataset_name, paths in output_paths.items():
+            for stage, source_path in paths.items():
+                name = f'{dataset_name}_all_{stage}.arrow'
+                source = storage.dataset_fingerprint(source_path)
+                old = previous['datasets'].get(dataset_name, {}).get(stage)
+                with metrics.stage('publish', dataset=dataset_name, output=stage) as record:
+                    if old is not None and old['source'] == source:
+                        _link_or_copy(os.path.join(directory, old['file']), os.path.join(tmp_dir, name))
+                        rows = old['rows']
+                    else:
+                        rows = write_arrow(source_path, os.path.join(tmp_dir, name), chunksize)
+                        record['bytes_read'] = metrics.path_size(source_path)
+                    record['rows_out'] = rows
+                    record['bytes_written'] = metrics.path_size(os.path.join(tmp_dir, name))
+                datasets.setdefault(dataset_name, {})[stage] = {
+                    'file': os.path.join('builds', build, name),
+                    'rows': rows,
+                    'source': source,
+                }
+        os.rename(tmp_dir, os.path.join(builds_dir, build))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'build': build,
+        'previous': previous['build'],
+        'published_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'datasets': datasets,
+    }
+    path = manifest_path(directory)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+    logger.info(f"Published build {build} to {directory}")
+    prune(directory)
+    return manifest
+
+def prune(directory=None, keep=KEEP_BUILDS):
+    """Remove all but the ``keep`` newest builds, never the current one."""
+    directory = directory or SHARED_DIR
+    builds_dir = os.path.join(directory, 'builds')
+    manifest = load_manifest(directory)
+    current = manifest['build'] if manifest else None
+    # Build ids start with their timestamp, so they sort oldest first
+    builds = sorted(name for name in os.listdir(builds_dir) if not name.endswith('.tmp'))
+    removed = []
+    for name in builds[:max(len(builds) - keep, 0)]:
+        if name != current:
+            shutil.rmtree(os.path.join(builds_dir, name), ignore_errors=True)
+            removed.append(name)
+    return removed
+
+class SharedDatasets:
+    """Zero-copy reader of the published build.
+
+    The manifest is read when the reader is created, pinning one build;
+    ``refresh`` switches to a newer build once it has been published. Tables
+    are memory-mapped, so every process reading the same build shares one
+    copy of the data in the OS page cache.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or SHARED_DIR
+        self.manifest = load_manifest(self.directory)
+        self._tables = {}
+
+    @property
+    def build(self):
+        return self.manifest['build'] if self.manifest else None
+
+    def refresh(self):
+        """Pick up a newer build; returns True if the build changed."""
+        manifest = load_manifest(self.directory)
+        if (manifest and manifest['build']) == self.build:
+            return False
+        self.manifest = manifest
+        self._tables = {}
+        return True
+
+    def entry(self, dataset_name, stage='cleaned'):
+        """Manifest entry (file, rows, source) of a published output, or None."""
+        if self.manifest is None:
+            return None
+        return self.manifest['datasets'].get(dataset_name, {}).get(stage)
+
+    def is_current(self, dataset_name, source_path, stage='cleaned'):
+        """Whether the published output was built from ``source_path`` as it is now."""
+        entry = self.entry(dataset_name, stage)
+        return entry is not None and entry['source'] == storage.dataset_fingerprint(source_path)
+
+    def table(self, dataset_name, stage='cleaned', columns=None):
+        """The published output as a memory-mapped pyarrow Table."""
+        key = (dataset_name, stage)
+        if key not in self._tables:
+            entry = self.entry(dataset_name, stage)
+            if entry is None:
+                raise KeyError(f"{dataset_name} {stage} is not in the shared cache at {self.directory}")
+            path = os.path.join(self.directory, entry['file'])
+            if not os.path.exists(path) and self.refresh():
+                # The pinned build was pruned before this output was opened
+                logger.warning(f"Build of {path} was removed, switched to build {self.build}")
+                return self.table(dataset_name, stage, columns)
+            pa = storage.require_pyarrow()
+            import pyarrow.ipc
+            self._tables[key] = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        table = self._tables[key]
+        return table.select(list(columns)) if columns is not None else table
+
+    def read(self, dataset_name, stage='cleaned', columns=None, arrow_dtypes=False):
+        """The published output as a DataFrame.
+
+        Columns are converted one block each, so strings and null-free numeric
+        columns keep pointing into the mapped file. ``arrow_dtypes`` uses
+        ``pd.ArrowDtype`` for every column, making nullable numerics
+        zero-copy too.
+        """
+        table = self.table(dataset_name, stage, columns)
+        return table.to_pandas(split_blocks=True, types_mapper=pd.ArrowDtype if arrow_dtypes else None)
+
+def read(dataset_name, stage='cleaned', columns=None, directory=None):
+    """Read a published output from the current build, e.g. in a notebook."""
+    return SharedDatasets(directory).read(dataset_name, stage, columns)
+
+def outputs_in(directory, datasets=renaming_mappin.DATASETS, stages=renaming_mappin.STAGES):
+    """``{dataset: {stage: path}}`` of the pipeline outputs present in ``directory``."""
+    found = {}
+    for dataset_name in datasets:
+        for stage in stages:
+            path = storage.find_dataset(directory, f'{dataset_name}_all_{stage}')
+            if path is not None:
+                found.setdefault(dataset_name, {})[stage] = path
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish and inspect the memory-mapped shared dataset cache.")
+    parser.add_argument('action', choices=['publish', 'info', 'prune'])
+    parser.add_argument('--datasets', nargs='+', choices=renaming_mappin.DATASETS,
+                        default=list(renaming_mappin.DATASETS))
+    parser.add_argument('--stages', nargs='+', choices=renaming_mappin.STAGES, default=['cleaned'])
+    parser.add_argument('--input-dir', default=renaming_mappin.OUTPUT_DIR)
+    parser.add_argument('--shared-dir', default=SHARED_DIR)
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--keep', type=int, default=KEEP_BUILDS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.action == 'publish':
+        outputs = outputs_in(args.input_dir, args.datasets, args.stages)
+        if not outputs:
+            parser.error(f"No pipeline outputs in {args.input_dir}")
+        manifest = publish(outputs, args.shared_dir, args.chunksize)
+        print(f"Published build {manifest['build']} to {args.shared_dir}")
+    elif args.action == 'prune':
+        removed = prune(args.shared_dir, args.keep)
+        print(f"Removed {len(removed)} builds")
+    else:
+        manifest = load_manifest(args.shared_dir)
+        if manifest is None:
+            print(f"Nothing published in {args.shared_dir}")
+            return
+        print(f"Build {manifest['build']} (published {manifest['published_at']})")
+        for dataset_name, entries in sorted(manifest['datasets'].items()):
+            for stage, entry in sorted(entries.items()):
+                size = os.path.getsize(os.path.join(args.shared_dir, entry['file']))
+                print(f"  {dataset_name} {stage}: {entry['rows']} rows, {size / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
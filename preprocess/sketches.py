@@ -0,0 +1,271 @@
+import os
+import json
+import argparse
+import pandas as pd
+from codebooks import COLUMN_MAPPINGS, NULL_REPRESENTATIONS, lookup
+
+SKETCH_DIR_NAME = 'sketches'
+SKETCH_VERSION = 1
+
+# Keys ranked per dataset and month: name -> raw columns forming the key. The
+# route is the notebook's US_State-Mexico_State-Canada_Province combination.
+KEYS = {
+    'commodity': ('COMMODITY2',),
+    'port': ('DEPE',),
+    'state': ('USASTATE',),
+    'country': ('COUNTRY',),
+    'mode': ('DISAGMOT',),
+    'route': ('USASTATE', 'MEXSTATE', 'CANPROV'),
+}
+
+# Keys with too many distinct values to count exactly; every other key keeps
+# an exact counter per month
+HEAVY_HITTER_KEYS = ('route',)
+CAPACITY = 1024
+
+# Ranking measures: name -> raw column summed (None counts records)
+MEASURES = {
+    'count': None,
+    'Weight': 'SHIPWT',
+    'Trade_Value': 'VALUE',
+}
+
+KEY_SEPARATOR = '-'
+
+class HeavyHitters:
+    """Space-Saving summary of the heaviest keys of one measure.
+
+    ``items`` maps each monitored key to ``[estimate, error]``: its true total
+    lies in ``[estimate - error, estimate]``. ``floor`` bounds the total of
+    any unmonitored key, and never exceeds ``total / capacity``. With
+    ``capacity=None`` every key is kept and all counts are exact. Summaries
+    are mergeable, so a month range is the ``merge`` of its months.
+    """
+
+    def __init__(self, capacity=None, items=None, floor=0.0, total=0.0):
+        self.capacity = capacity
+        self.items = items or {}
+        self.floor = floor
+        self.total = total
+
+    @classmethod
+    def from_totals(cls, totals, capacity=None):
+        """Summarize exact per-key totals (a Series), keeping the top ``capacity``."""
+        totals = totals[totals > 0].sort_values(ascending=False, kind='stable')
+        summary = cls(capacity, total=float(totals.sum()))
+        if capacity is not None and len(totals) > capacity:
+            summary.floor = float(totals.iloc[capacity])
+            totals = totals.iloc[:capacity]
+        summary.items = {str(key): [float(value), 0.0] for key, value in totals.items()}
+        return summary
+
+    def merge(self, other):
+        """Add another summary's totals to this one and return self."""
+        merged = {}
+        for key in self.items.keys() | other.items.keys():
+            mine = self.items.get(key, (self.floor, self.floor))
+            theirs = other.items.get(key, (other.floor, other.floor))
+            merged[key] = [mine[0] + theirs[0], mine[1] + theirs[1]]
+        floor = self.floor + other.floor
+        if self.capacity is not None and len(merged) > self.capacity:
+            ranked = sorted(merged.items(), key=lambda item: (-item[1][0], item[0]))
+            # Keys dropped here are bounded by the largest estimate dropped
+            floor = max(floor, ranked[self.capacity][1][0])
+            merged = dict(ranked[:self.capacity])
+        self.items = merged
+        self.floor = floor
+        self.total += other.total
+        return self
+
+    def top(self, n=10):
+        """The ``n`` keys with the largest estimates, as a DataFrame.
+
+        ``guaranteed`` marks keys whose lower bound beats every key ranked
+        below them, so they are certainly in the true top ``n``.
+        """
+        ranked = sorted(self.items.items(), key=lambda item: (-item[1][0], item[0]))
+        threshold = max([self.floor] + [estimate for _, (estimate, _) in ranked[n:n + 1]])
+        rows = [{'key': key, 'estimate': estimate, 'lower_bound': estimate - error, 'error': error,
+                 'guaranteed': estimate - error >= threshold}
+                for key, (estimate, error) in ranked[:n]]
+        return pd.DataFrame(rows, columns=['key', 'estimate', 'lower_bound', 'error', 'guaranteed'])
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'floor': self.floor, 'total': self.total, 'items': self.items}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['capacity'], {key: list(entry) for key, entry in data['items'].items()},
+                   data['floor'], data['total'])
+
+def _periods(df):
+    """``YYYY-MM`` of each row from the raw YEAR and MONTH columns (None if invalid)."""
+    year = pd.to_numeric(df['YEAR'], errors='coerce')
+    month = pd.to_numeric(df['MONTH'], errors='coerce')
+    valid = year.notna() & month.between(1, 12)
+    periods = pd.Series(None, index=df.index, dtype=object)
+    periods[valid] = (year[valid].astype(int).astype(str) + '-' +
+                      month[valid].astype(int).astype(str).str.zfill(2))
+    return periods
+
+def _codes(series):
+    """Raw codes as stripped strings, with every null spelling folded into ''."""
+    codes = series.fillna('').astype(str).str.strip()
+    return codes.where(~codes.isin(NULL_REPRESENTATIONS), '')
+
+def _keys(df, columns):
+    keys = _codes(df[columns[0]])
+    for col in columns[1:]:
+        keys = keys + KEY_SEPARATOR + _codes(df[col])
+    return keys
+
+class SketchIndex:
+    """Per-month rankings of every key in ``KEYS`` for each ``MEASURES`` entry.
+
+    Laid out as ``{dataset: {period: {key: {measure: HeavyHitters}}}}`` with
+    periods as ``YYYY-MM``. Built from raw (combined) rows at ingest, and
+    rebuilt from the deduplicated rows by ``quality.py``; like
+    ``CoverageIndex``, the index of a dataset is the ``merge`` of the indexes
+    of its files, and top-N queries only read the summaries.
+    """
+
+    def __init__(self, sketches=None, capacity=CAPACITY):
+        self.sketches = sketches or {}
+        self.capacity = capacity
+
+    def _target(self, dataset_name, period, key_name, measure):
+        """The summary a period's key/measure is added to, created empty if new."""
+        measures = self.sketches.setdefault(dataset_name, {}).setdefault(period, {}).setdefault(key_name, {})
+        if measure not in measures:
+            measures[measure] = HeavyHitters(self.capacity if key_name in HEAVY_HITTER_KEYS else None)
+        return measures[measure]
+
+    def observe(self, dataset_name, df):
+        """Add the rows of a raw frame (one source file or chunk)."""
+        if 'YEAR' not in df.columns or 'MONTH' not in df.columns:
+            return
+        periods = _periods(df)
+        valid = periods.notna()
+        values = pd.DataFrame({'period': periods[valid]})
+        for measure, col in MEASURES.items():
+            if col is None:
+                values[measure] = 1.0
+            elif col in df.columns:
+                # Space-Saving needs non-negative weights
+                values[measure] = pd.to_numeric(df.loc[valid, col], errors='coerce').fillna(0).clip(lower=0)
+
+        for key_name, columns in KEYS.items():
+            if not set(columns) <= set(df.columns):
+                continue
+            capacity = self.capacity if key_name in HEAVY_HITTER_KEYS else None
+            totals = values.groupby(['period', _keys(df.loc[valid], columns).rename('key')]).sum()
+            for period, period_totals in totals.groupby(level='period'):
+                period_totals = period_totals.droplevel('period')
+                for measure in period_totals.columns:
+                    summary = HeavyHitters.from_totals(period_totals[measure], capacity)
+                    self._target(dataset_name, period, key_name, measure).merge(summary)
+
+    def merge(self, other):
+        """Add another index's summaries to this one and return self."""
+        for dataset_name, periods in other.sketches.items():
+            for period, keys in periods.items():
+                for key_name, measures in keys.items():
+                    for measure, summary in measures.items():
+                        self._target(dataset_name, period, key_name, measure).merge(summary)
+        return self
+
+    def periods(self, dataset_name):
+        return sorted(self.sketches.get(dataset_name, {}))
+
+    def summary(self, dataset_name, key_name, measure='count', start=None, end=None):
+        """Merged summary of ``key_name`` over the periods ``start``..``end`` (inclusive)."""
+        merged = None
+        for period in self.periods(dataset_name):
+            if (start and period < start) or (end and period > end):
+                continue
+            summary = self.sketches[dataset_name][period].get(key_name, {}).get(measure)
+            if summary is None:
+                continue
+            if merged is None:
+                merged = HeavyHitters(summary.capacity)
+            merged.merge(summary)
+        if merged is None:
+            raise KeyError(f"No {key_name}/{measure} sketches for {dataset_name} in {start}..{end}")
+        return merged
+
+    def top(self, dataset_name, key_name, n=10, measure='count', start=None, end=None):
+        """Top ``n`` keys by ``measure`` over a month range, with codebook labels.
+
+        Exact for every key but the route; route estimates come with the
+        Space-Saving error bound (see ``HeavyHitters.top``).
+        """
+        result = self.summary(dataset_name, key_name, measure, start, end).top(n)
+        result.insert(1, 'label', [label(key_name, key) for key in result['key']])
+        return result
+
+    def to_dict(self):
+        return {dataset_name: {period: {key_name: {measure: summary.to_dict()
+                                                   for measure, summary in measures.items()}
+                                        for key_name, measures in keys.items()}
+                               for period, keys in periods.items()}
+                for dataset_name, periods in self.sketches.items()}
+
+    @classmethod
+    def from_dict(cls, data, capacity=CAPACITY):
+        return cls({dataset_name: {period: {key_name: {measure: HeavyHitters.from_dict(summary)
+                                                       for measure, summary in measures.items()}
+                                            for key_name, measures in keys.items()}
+                                   for period, keys in periods.items()}
+                    for dataset_name, periods in data.items()}, capacity)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != SKETCH_VERSION:
+            raise ValueError(f"Unsupported sketch version in {path}; rebuild it")
+        return cls.from_dict(data['sketches'], data['capacity'])
+
+    def save(self, path):
+        """Write the index as JSON (atomically)."""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': SKETCH_VERSION, 'capacity': self.capacity, 'sketches': self.to_dict()}, f)
+        os.replace(tmp_path, path)
+        return path
+
+def label(key_name, key):
+    """Readable label of a raw key, e.g. a route's mapped state/state/province."""
+    codes = key.split(KEY_SEPARATOR) if len(KEYS[key_name]) > 1 else [key]
+    return KEY_SEPARATOR.join(lookup(COLUMN_MAPPINGS[col], code) for col, code in zip(KEYS[key_name], codes))
+
+def sketch_path(directory, dataset_name):
+    return os.path.join(directory, SKETCH_DIR_NAME, f'{dataset_name}_sketches.json')
+
+def save_index(index, directory):
+    """Save one sketch file per dataset under ``directory/sketches``."""
+    os.makedirs(os.path.join(directory, SKETCH_DIR_NAME), exist_ok=True)
+    for dataset_name, periods in index.sketches.items():
+        SketchIndex({dataset_name: periods}, index.capacity).save(sketch_path(directory, dataset_name))
+
+def load_index(directory, dataset_name):
+    return SketchIndex.load(sketch_path(directory, dataset_name))
+
+if __name__ == "__main__":
+    # Imported here: only the query CLI needs the default data directory
+    import combining
+
+    parser = argparse.ArgumentParser(description="Top-N keys from the ingest-time sketches.")
+    parser.add_argument('dataset', choices=['dot1', 'dot2', 'dot3'])
+    parser.add_argument('key', choices=list(KEYS))
+    parser.add_argument('--measure', choices=list(MEASURES), default='count')
+    parser.add_argument('-n', type=int, default=10)
+    parser.add_argument('--start', default=None, help="First month, YYYY-MM")
+    parser.add_argument('--end', default=None, help="Last month, YYYY-MM")
+    parser.add_argument('--data-dir', default=combining.OUTPUT_DIR)
+    args = parser.parse_args()
+
+    index = load_index(args.data_dir, args.dataset)
+    print(index.top(args.dataset, args.key, args.n, args.measure, args.start, args.end).to_string(index=False))
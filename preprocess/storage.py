@@ -0,0 +1,212 @@
+import os
+import shutil
+import hashlib
+import pandas as pd
+
+# Supported on-disk formats for worked_data artifacts
+FORMATS = ('csv', 'parquet')
+
+# A CSV artifact may also be stored compressed (renaming_mappin.py --codec);
+# pandas and DuckDB pick the decompression from the suffix
+CSV_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst')
+
+# Columns used to partition columnar outputs (matched case-insensitively so
+# both raw YEAR/MONTH and renamed Year/Month frames are partitioned)
+PARTITION_COLUMNS = ('YEAR', 'MONTH')
+
+PARQUET_COMPRESSION = 'zstd'
+
+def require_pyarrow():
+    """Import pyarrow, raising a helpful error if it is not installed."""
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as e:
+        raise ImportError("The parquet format requires pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+def dataset_path(directory, name, fmt='csv'):
+    """Return the path of a named artifact, e.g. dot1_all.csv or dot1_all/."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+    if fmt == 'csv':
+        return os.path.join(directory, f'{name}.csv')
+    return os.path.join(directory, name)
+
+def _artifact_forms(directory, name):
+    """Every path an artifact called ``name`` may have, in reading preference."""
+    return [dataset_path(directory, name, 'parquet')] + [os.path.join(directory, name + suffix)
+                                                         for suffix in CSV_SUFFIXES]
+
+def find_dataset(directory, name):
+    """Path of the existing artifact called ``name``, or None.
+
+    The parquet form is preferred, then plain CSV, then compressed CSV.
+    """
+    for path in _artifact_forms(directory, name):
+        if os.path.exists(path):
+            return path
+    return None
+
+def remove_other_formats(path, fmt):
+    """Delete the artifact of the same name in every other format or compression.
+
+    Readers prefer the parquet form of an artifact when both exist, so one
+    left over from an earlier run in another form would shadow (or be
+    shadowed by) the artifact being written. Called before every write.
+    """
+    name = path
+    if fmt == 'csv':
+        suffix = next((suffix for suffix in CSV_SUFFIXES if path.endswith(suffix)), None)
+        if suffix is None:
+            return
+        name = path[:-len(suffix)]
+    for stale in _artifact_forms(os.path.dirname(name), os.path.basename(name)):
+        if stale == path:
+            continue
+        if os.path.isdir(stale):
+            shutil.rmtree(stale)
+        elif os.path.exists(stale):
+            os.remove(stale)
+
+def dataset_fingerprint(path):
+    """Hash of a dataset's file names, sizes and modification times.
+
+    Cheap enough to check on every call; rewriting any file of the dataset
+    changes it.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    for file in files:
+        stat = os.stat(file)
+        digest.update(f'{os.path.relpath(file, path)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+def detect_format(path):
+    """Infer the storage format of an existing artifact from its path."""
+    if os.path.isdir(path) or path.endswith('.parquet'):
+        return 'parquet'
+    return 'csv'
+
+def partition_columns(columns):
+    """Return the partition columns present in ``columns``, keeping their case."""
+    by_upper = {str(col).upper(): col for col in columns}
+    return [by_upper[name] for name in PARTITION_COLUMNS if name in by_upper]
+
+def write_dataset(df, path, fmt='csv', partition_cols=None, append=False, basename=None):
+    """Write a frame as CSV or as a YEAR/MONTH partitioned parquet dataset.
+
+    With ``append=True`` CSV rows are appended without a header and parquet
+    fragments are added next to the existing ones; ``basename`` names the
+    fragment files (defaults to a unique name chosen by pyarrow). A new
+    (non-appending) write removes the artifact's other format.
+    """
+    if not append:
+        remove_other_formats(path, fmt)
+    if fmt == 'csv':
+        header = not (append and os.path.exists(path))
+        df.to_csv(path, mode='a' if append else 'w', header=header, index=False)
+        return path
+    if fmt != 'parquet':
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+
+    pa = require_pyarrow()
+    if not append and os.path.isdir(path):
+        shutil.rmtree(path)
+    elif not append and os.path.exists(path):
+        os.remove(path)
+    if partition_cols is None:
+        partition_cols = partition_columns(df.columns)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    kwargs = {}
+    if basename:
+        kwargs['basename_template'] = f'{basename}-{{i}}.parquet'
+    pa.parquet.write_to_dataset(
+        table,
+        root_path=path,
+        partition_cols=list(partition_cols) or None,
+        compression=PARQUET_COMPRESSION,
+        existing_data_behavior='overwrite_or_ignore',
+        **kwargs,
+    )
+    return path
+
+def open_parquet_dataset(path):
+    """Open a partitioned parquet dataset with a schema unified across fragments.
+
+    Fragments written at different times (e.g. by incremental rebuilds) may
+    carry different column sets, and a measure may be int64 in one fragment
+    and double in another; unifying their schemas (promoting such columns to
+    double) keeps every column readable instead of silently taking the first
+    fragment's schema.
+    """
+    pa = require_pyarrow()
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    schemas = [dataset.schema] + [fragment.physical_schema for fragment in dataset.get_fragments()]
+    schema = pa.unify_schemas(schemas, promote_options='permissive')
+    return ds.dataset(path, schema=schema, format='parquet', partitioning='hive')
+
+def read_columns(path, fmt=None):
+    """Return the column names of an artifact without reading its rows."""
+    fmt = fmt or detect_format(path)
+    if fmt == 'parquet':
+        return open_parquet_dataset(path).schema.names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+def _filters_to_expression(filters):
+    if not filters:
+        return None
+    import pyarrow.parquet as pq
+    return pq.filters_to_expression(filters)
+
+def _apply_filters(df, filters):
+    """Apply pyarrow-style ``[(column, op, value), ...]`` filters to a frame."""
+    ops = {
+        '=': lambda s, v: s == v,
+        '==': lambda s, v: s == v,
+        '!=': lambda s, v: s != v,
+        '<': lambda s, v: s < v,
+        '<=': lambda s, v: s <= v,
+        '>': lambda s, v: s > v,
+        '>=': lambda s, v: s >= v,
+        'in': lambda s, v: s.isin(v),
+        'not in': lambda s, v: ~s.isin(v),
+    }
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        if op not in ops:
+            raise ValueError(f"Unsupported filter operator {op!r}")
+        mask &= ops[op](df[col], value)
+    return df[mask]
+
+def read_dataset(path, columns=None, filters=None, fmt=None, chunksize=1_000_000):
+    """Read an artifact, loading only ``columns`` and rows matching ``filters``.
+
+    For parquet the projection and filters are pushed down to pyarrow, so only
+    the requested columns of the matching YEAR/MONTH partitions are read. CSV
+    artifacts are scanned in chunks and filtered as they are parsed.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt == 'parquet':
+        return open_parquet_dataset(path).to_table(
+            columns=columns,
+            filter=_filters_to_expression(filters),
+        ).to_pandas()
+    if fmt != 'csv':
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+
+    if not filters:
+        return pd.read_csv(path, usecols=columns)
+    usecols = None
+    if columns is not None:
+        usecols = list(dict.fromkeys(list(columns) + [col for col, _, _ in filters]))
+    parts = [_apply_filters(chunk, filters)
+             for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunksize)]
+    df = pd.concat(parts, ignore_index=True)
+    return df[columns] if columns is not None else df
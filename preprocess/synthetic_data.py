@@ -0,0 +1,107 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from codebooks import MAPPINGS
+from schema import DATASET_COLUMNS
+
+# Code columns and the codebook their values are drawn from
+CODE_SOURCES = {
+    'TRDTYPE': 'trade_type_map',
+    'USASTATE': 'us_state_map',
+    'DEPE': 'port_district_map',
+    'DISAGMOT': 'mode_map',
+    'MEXSTATE': 'mex_state_map',
+    'CANPROV': 'canada_prov_map',
+    'COUNTRY': 'country_map',
+    'COMMODITY2': 'commodity_map',
+    'DF': 'df_map',
+    'CONTCODE': 'container_code_map',
+}
+
+# Share of empty cells per column, roughly as seen in the BTS files (Mexican
+# and Canadian columns are only filled for their own country, DF mostly on
+# exports, freight charges mostly on imports)
+NULL_RATES = {
+    'USASTATE': 0.02,
+    'MEXSTATE': 0.6,
+    'CANPROV': 0.45,
+    'DF': 0.5,
+    'CONTCODE': 0.1,
+    'FREIGHT_CHARGES': 0.3,
+}
+
+# Share of codes replaced by values missing from the codebooks
+UNKNOWN_CODE_RATE = 0.001
+
+def _skewed_choice(rng, codes, size, skew=1.2):
+    """Draw codes with a Zipf-like skew so a few ports/states dominate."""
+    weights = 1.0 / np.arange(1, len(codes) + 1) ** skew
+    rng.shuffle(weights)
+    return rng.choice(np.asarray(codes, dtype=object), size=size, p=weights / weights.sum())
+
+def generate_month(dataset_name, year, month, rows, seed=0):
+    """Generate one month of a dataset with the raw BTS column layout."""
+    rng = np.random.default_rng([seed, year, month, int(dataset_name[-1])])
+    columns = [c for c in DATASET_COLUMNS[dataset_name] if c != 'SOURCE_FILE']
+    data = {}
+    for col in columns:
+        if col in CODE_SOURCES:
+            codes = list(MAPPINGS[CODE_SOURCES[col]])
+            values = _skewed_choice(rng, codes, rows)
+            unknown = rng.random(rows) < UNKNOWN_CODE_RATE
+            values[unknown] = 'ZZ99'
+            data[col] = values
+        elif col == 'VALUE':
+            data[col] = rng.lognormal(10, 2.5, rows).astype(np.int64)
+        elif col == 'SHIPWT':
+            weight = rng.lognormal(8, 3, rows).astype(np.int64)
+            weight[rng.random(rows) < 0.05] = 0
+            data[col] = weight
+        elif col == 'FREIGHT_CHARGES':
+            data[col] = rng.lognormal(6, 2, rows).astype(np.int64)
+        elif col == 'MONTH':
+            data[col] = np.full(rows, month)
+        elif col == 'YEAR':
+            data[col] = np.full(rows, year)
+
+    df = pd.DataFrame(data, columns=columns)
+    for col, rate in NULL_RATES.items():
+        if col in df.columns:
+            df[col] = df[col].astype(object)
+            df.loc[rng.random(rows) < rate, col] = None
+    return df
+
+def generate(output_dir, rows, datasets=('dot1', 'dot2', 'dot3'), start_year=2020, months=60, seed=0):
+    """Write monthly ``dotN_MMYY.csv`` files under ``output_dir/<year>/``.
+
+    ``rows`` is the total row count per dataset, spread evenly over ``months``
+    consecutive months starting in January of ``start_year``. Returns the
+    list of files written.
+    """
+    files = []
+    per_month = max(1, rows // months)
+    for i in range(months):
+        year, month = start_year + i // 12, i % 12 + 1
+        year_dir = os.path.join(output_dir, str(year))
+        os.makedirs(year_dir, exist_ok=True)
+        for dataset_name in datasets:
+            n = per_month + (rows - per_month * months if i == months - 1 else 0)
+            df = generate_month(dataset_name, year, month, max(n, 0), seed)
+            path = os.path.join(year_dir, f'{dataset_name}_{month:02d}{year % 100:02d}.csv')
+            df.to_csv(path, index=False)
+            files.append(path)
+    return files
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic BTS-shaped dot1/dot2/dot3 files.")
+    parser.add_argument('output_dir')
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Rows per dataset")
+    parser.add_argument('--months', type=int, default=60)
+    parser.add_argument('--start-year', type=int, default=2020)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    files = generate(args.output_dir, args.rows, start_year=args.start_year,
+                     months=args.months, seed=args.seed)
+    print(f"Wrote {len(files)} files to {args.output_dir}")
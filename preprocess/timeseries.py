@@ -0,0 +1,253 @@
+import os
+import json
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+import cube
+import renaming_mappin
+import storage
+
+logger = logging.getLogger(__name__)
+
+TIMESERIES_DIR = os.path.join(renaming_mappin.OUTPUT_DIR, 'timeseries')
+STORE_VERSION = 1
+
+MEASURES = ('Weight', 'Trade_Value', 'Freight_Charges')
+
+# Rollups kept per dataset: name -> dimension rolled up by period (None for
+# the dataset total). Rollups whose dimension is missing from a dataset are skipped.
+ROLLUPS = {
+    'total': None,
+    'mode': 'Mode_of_Transport',
+    'country': 'Country',
+    'port': 'Port_District',
+    'commodity': 'Commodity_Code',
+}
+
+# Key of the single series of the 'total' rollup
+TOTAL_KEY = 'All'
+
+def period_ordinals(year, month):
+    """Monthly period ordinals (months since 1970-01) of Year and Month columns.
+
+    ``month`` may hold month_map labels or raw month numbers. Rows whose year
+    or month cannot be placed get -1.
+    """
+    month = pd.Series(month)
+    numbers = month.astype(str).map(cube.MONTH_NUMBERS)
+    numbers = numbers.fillna(pd.to_numeric(month, errors='coerce'))
+    year = pd.to_numeric(pd.Series(year, index=month.index), errors='coerce')
+    valid = numbers.between(1, 12) & year.notna()
+    ordinals = (year - 1970) * 12 + numbers - 1
+    return ordinals.where(valid, -1).astype('int64').to_numpy()
+
+def to_periods(ordinals):
+    """PeriodIndex of monthly ordinals; -1 becomes NaT."""
+    ordinals = np.asarray(ordinals, dtype='int64')
+    ordinals = np.where(ordinals < 0, np.iinfo('int64').min, ordinals)
+    return pd.PeriodIndex(pd.arrays.PeriodArray(ordinals, dtype=pd.PeriodDtype('M')))
+
+def period_index(df):
+    """Chronological monthly ``PeriodIndex`` of a frame's Year and Month columns.
+
+    Unlike the ``Year-Month`` label strings, it sorts in calendar order and
+    supports range slicing and period arithmetic.
+    """
+    return to_periods(period_ordinals(df['Year'], df['Month']))
+
+def rollup_frames(df):
+    """Sum ``MEASURES`` of one frame by period for every rollup.
+
+    Returns ``{rollup: DataFrame}`` in long form with ``Period`` (as ordinal),
+    ``Key``, one column per measure and a ``Records`` count. Rows without a
+    valid period are left out. Rollups are plain sums, so the rollups of a
+    dataset are the ``combine`` of the rollups of its chunks.
+    """
+    ordinals = pd.Series(period_ordinals(df['Year'], df['Month']), index=df.index, name='Period')
+    valid = ordinals >= 0
+    measures = [m for m in MEASURES if m in df.columns]
+    values = pd.DataFrame({m: pd.to_numeric(df[m], errors='coerce') for m in measures}, index=df.index)
+    values['Records'] = 1
+    values, ordinals = values[valid], ordinals[valid]
+
+    frames = {}
+    for name, dimension in ROLLUPS.items():
+        if dimension is None:
+            keys = pd.Series(TOTAL_KEY, index=values.index)
+        elif dimension in df.columns:
+            keys = df.loc[valid, dimension].astype(str)
+        else:
+            continue
+        grouped = values.groupby([ordinals, keys.rename('Key')], observed=True).sum()
+        frames[name] = grouped.reset_index()
+    return frames
+
+def combine(parts):
+    """Sum lists of per-chunk ``rollup_frames`` results into one."""
+    frames = {}
+    for part in parts:
+        for name, frame in part.items():
+            frames.setdefault(name, []).append(frame)
+    return {name: pd.concat(chunks, ignore_index=True).groupby(['Period', 'Key'], observed=True)
+            .sum().reset_index()
+            for name, chunks in frames.items()}
+
+def read_source(path, chunksize=1_000_000):
+    """Stream the period, rollup dimension and measure columns of a cleaned dataset."""
+    wanted = {'Year', 'Month'} | {d for d in ROLLUPS.values() if d} | set(MEASURES)
+    fmt = storage.detect_format(path)
+    columns = [col for col in storage.read_columns(path, fmt) if col in wanted]
+    if fmt == 'csv':
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+    for batch in storage.open_parquet_dataset(path).to_batches(columns=columns, batch_size=chunksize):
+        yield batch.to_pandas()
+
+class TimeSeriesStore:
+    """Monthly rollups of one dataset, held as wide Period x Key tables.
+
+    Every rollup covers the same complete, gap-free monthly ``PeriodIndex``
+    (months without records are 0), so ranges slice with ``.loc`` and
+    month-over-month and year-over-year changes are plain shifts by 1 and 12
+    rows. ``source`` is the fingerprint of the cleaned dataset it was built from.
+    """
+
+    def __init__(self, frames, source=None):
+        self.frames = frames
+        self.source = source
+        ordinals = [frame['Period'] for frame in frames.values() if len(frame)]
+        if ordinals:
+            first = min(int(o.min()) for o in ordinals)
+            last = max(int(o.max()) for o in ordinals)
+            self.periods = to_periods(np.arange(first, last + 1))
+        else:
+            self.periods = to_periods([])
+        self._wide = {}
+
+    @classmethod
+    def build(cls, chunks, source=None):
+        """Build a store from an iterable of cleaned-data frames."""
+        return cls(combine(rollup_frames(chunk) for chunk in chunks), source)
+
+    @property
+    def rollups(self):
+        return list(self.frames)
+
+    def table(self, rollup):
+        """Wide table of a rollup: Period rows, ``(measure, key)`` columns."""
+        if rollup not in self._wide:
+            frame = self.frames[rollup]
+            wide = frame.set_index(['Period', 'Key']).unstack('Key', fill_value=0)
+            wide = wide.reindex(self.periods.asi8, fill_value=0)
+            wide.index = self.periods.rename('Period')
+            self._wide[rollup] = wide.sort_index(axis=1)
+        return self._wide[rollup]
+
+    def frame(self, rollup='total', measure='Weight', start=None, end=None, keys=None):
+        """Period x key table of ``measure`` between ``start`` and ``end`` (inclusive)."""
+        table = self.table(rollup)[measure].loc[start:end].rename_axis(columns=ROLLUPS[rollup] or 'Key')
+        return table if keys is None else table[list(keys)]
+
+    def series(self, rollup='total', key=TOTAL_KEY, measure='Weight', start=None, end=None):
+        """Monthly ``measure`` of one key of a rollup."""
+        return self.table(rollup)[measure][key].loc[start:end].rename(measure)
+
+    def changes(self, rollup='total', key=TOTAL_KEY, measure='Weight', start=None, end=None):
+        """``measure`` with its MoM and YoY deltas and percent changes.
+
+        Deltas are computed over the whole store before slicing, so the first
+        months of a range still compare against the months before it.
+        Changes from a zero month are NaN.
+        """
+        s = self.series(rollup, key, measure)
+        previous_month = s.shift(1)
+        previous_year = s.shift(12)
+        result = pd.DataFrame({
+            measure: s,
+            'MoM': s - previous_month,
+            'MoM_pct': (s / previous_month.replace(0, np.nan) - 1) * 100,
+            'YoY': s - previous_year,
+            'YoY_pct': (s / previous_year.replace(0, np.nan) - 1) * 100,
+        })
+        return result.loc[start:end]
+
+    def decomposition_input(self, rollup='total', key=TOTAL_KEY, measure='Weight', start=None, end=None):
+        """Regular month-start series for seasonal decomposition (period=12)."""
+        s = self.series(rollup, key, measure, start, end)
+        s.index = s.index.to_timestamp()
+        return s.asfreq('MS')
+
+    def save(self, dataset_name, directory=None, fmt='csv'):
+        """Write every rollup, then the metadata file that makes the store visible."""
+        directory = directory or TIMESERIES_DIR
+        os.makedirs(directory, exist_ok=True)
+        for name, frame in self.frames.items():
+            frame = frame.assign(Period=to_periods(frame['Period']).astype(str))
+            path = storage.dataset_path(directory, f'{dataset_name}_{name}', fmt)
+            # Rollups are small; keep each in a single file
+            storage.write_dataset(frame, path, fmt, partition_cols=[])
+        meta = {
+            'version': STORE_VERSION,
+            'source': self.source,
+            'format': fmt,
+            'periods': [str(self.periods[0]), str(self.periods[-1])] if len(self.periods) else None,
+            'rollups': {name: len(frame) for name, frame in self.frames.items()},
+        }
+        path = meta_path(dataset_name, directory)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, dataset_name, directory=None):
+        """Load a saved store, or return None if there is none (or of another version)."""
+        directory = directory or TIMESERIES_DIR
+        try:
+            with open(meta_path(dataset_name, directory)) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        if meta.get('version') != STORE_VERSION:
+            return None
+        frames = {}
+        for name in meta['rollups']:
+            path = storage.dataset_path(directory, f'{dataset_name}_{name}', meta['format'])
+            frame = storage.read_dataset(path, fmt=meta['format'])
+            frame['Period'] = pd.PeriodIndex(frame['Period'].astype(str), freq='M').asi8
+            frame['Key'] = frame['Key'].astype(str)
+            frames[name] = frame
+        return cls(frames, meta['source'])
+
+def meta_path(dataset_name, directory=None):
+    return os.path.join(directory or TIMESERIES_DIR, f'{dataset_name}_timeseries.json')
+
+def build_store(path, chunksize=1_000_000):
+    """Build the store of a cleaned dataset, stamped with its fingerprint."""
+    return TimeSeriesStore.build(read_source(path, chunksize), storage.dataset_fingerprint(path))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build monthly time-series rollups from the cleaned datasets.")
+    parser.add_argument('--datasets', nargs='+', choices=renaming_mappin.DATASETS,
+                        default=list(renaming_mappin.DATASETS))
+    parser.add_argument('--input-dir', default=renaming_mappin.OUTPUT_DIR)
+    parser.add_argument('--output-dir', default=TIMESERIES_DIR)
+    parser.add_argument('--format', choices=storage.FORMATS, default='csv')
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    for dataset_name in args.datasets:
+        path = storage.find_dataset(args.input_dir, f'{dataset_name}_all_cleaned')
+        if path is None:
+            logger.warning(f"No cleaned {dataset_name} dataset in {args.input_dir}")
+            continue
+        store = build_store(path, args.chunksize)
+        store.save(dataset_name, args.output_dir, args.format)
+        logger.info(f"Built {dataset_name} time series over {len(store.periods)} months: " +
+                    ", ".join(f"{k}={len(v)}" for k, v in store.frames.items()))
+
+if __name__ == "__main__":
+    main()